@@ -23,15 +23,47 @@ SOFTWARE.
 """
 
 # standard
+import array
+import base64
 import bisect
 import collections
+import concurrent.futures
+import cProfile
+import fnmatch
+import functools
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import operator
+import os
+import pstats
 import re
+import struct
 import sys
+import threading
+import time
+import zlib
 
 # sublime
 import sublime
 import sublime_plugin
 
+# package
+try:
+    from .exact_quick_find_match import compile_pattern, word_pattern
+except ImportError:
+    # loaded as a top-level module
+    from exact_quick_find_match import compile_pattern, word_pattern
+
+# optional
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # --- macros ------------------------------------------------------------------
 
@@ -39,6 +71,10 @@ class Def:
     CASE = True
     WORD = True
     WRAP = True
+    SCOPE = False
+    SCOPE_SELECTOR = ""
+    REGEX = False
+    REGEX_TIME_BUDGET = 200
     FLIP_CASE = True
     FLIP_WORD = True
     FLIP_WRAP = False
@@ -50,6 +86,18 @@ class Def:
     SHOW_NOTICE = True
     INDICATOR = "icon"
     SHOW_ICON = True
+    LIVE_COUNT = True
+    LIVE_COUNT_DELAY = 300
+    LIVE_COUNT_LIMIT = 10000
+    DENSITY_BINS = 20
+    PROJECT_MAX_FILE_SIZE = 16 * 1024 * 1024
+    TRIGRAM_INDEX = False
+    BACKEND = "auto"
+    HISTORY_LIMIT = 100000
+    RESUME = True
+    SHOW_LINE_NUMBER = False
+    ASYNC_SEARCH = True
+    PROFILE_TIME_LIMIT = 60
     DEBUG = False
     DEBUG_WATCHLIST = []
     DEBUG_BLOCKLIST = []
@@ -125,7 +173,25 @@ g_set = None
 g_case = None
 g_word = None
 g_wrap = None
+g_scope = None
+g_regex = None
 g_eqf_center = {}
+g_previews = {}
+g_flags = (None, "")
+g_match_center = {}
+g_scope_runs = {}
+g_line_indexes = {}
+g_count_tokens = {}
+g_view_scans = {}
+g_file_scans = collections.OrderedDict()
+g_trigram_index = None
+g_trigram_stats = {}
+g_trigram_dirty = set()
+g_trigram_lock = threading.Lock()
+g_recorders = {}
+g_pending = {}
+g_profile = None
+g_executor = None
 
 
 def plugin_loaded():
@@ -135,7 +201,7 @@ def plugin_loaded():
     if active_view is None:
         _debug_print("Active view is None in Window {}".format(w.id()))
     else:
-        _set_status(_get_eqf(active_view))
+        _show_status(active_view)
     _debug_print("-----------------------")
     _debug_print("Exact Quick Find Loaded")
     _debug_print("-----------------------")
@@ -149,13 +215,33 @@ if int(sublime.version()) < 3000:
 def plugin_unloaded():
     global g_eqf_center
     all_views = []
+    resume = g_set.get("resume_after_reload", Def.RESUME)
     for vid in g_eqf_center:
         eqf = g_eqf_center[vid]
         all_views.append(eqf.view)
+        if resume and eqf.init and eqf.view.is_valid():
+            _save_ring(eqf)
         _reset_status(eqf)
         eqf.view.erase_regions("exact_quick_find_indicator")
     for view in all_views:
         _del_eqf(view)
+    g_previews.clear()
+    g_set.clear_on_change("exact_quick_find")
+    g_match_center.clear()
+    g_scope_runs.clear()
+    g_line_indexes.clear()
+    g_regex_cache.clear()
+    g_regex_verdicts.clear()
+    g_word_indexes.clear()
+    g_view_scans.clear()
+    _clear_file_scans()
+    _close_trigram_index()
+    for vid in list(g_recorders):
+        _stop_recording(vid)
+    g_pending.clear()
+    _stop_profile()
+    if g_executor is not None:
+        g_executor.shutdown(wait=False)
     _debug_assert(not g_eqf_center, "Expect empty g_eqf_center")
     _debug_print("Bye ~")
 
@@ -165,13 +251,21 @@ def _load_settings():
     global g_case
     global g_word
     global g_wrap
+    global g_scope
+    global g_regex
     g_set = sublime.load_settings(g_set_filename)
+    g_set.clear_on_change("exact_quick_find")
+    g_set.add_on_change("exact_quick_find", _clear_flags)
     if g_case is None:
         g_case = g_set.get("default_case_sensitive", Def.CASE)
     if g_word is None:
         g_word = g_set.get("default_whole_word", Def.WORD)
     if g_wrap is None:
         g_wrap = g_set.get("default_wrap_scan", Def.WRAP)
+    if g_scope is None:
+        g_scope = g_set.get("default_scope_filter", Def.SCOPE)
+    if g_regex is None:
+        g_regex = g_set.get("default_regex", Def.REGEX)
 
 
 def _save_settings():
@@ -179,12 +273,25 @@ def _save_settings():
     g_set.set("default_case_sensitive", g_case)
     g_set.set("default_whole_word", g_word)
     g_set.set("default_wrap_scan", g_wrap)
+    g_set.set("default_scope_filter", g_scope)
+    g_set.set("default_regex", g_regex)
     sublime.save_settings(g_set_filename)
 
 
+def _clear_flags():
+    global g_flags
+    g_flags = (None, "")
+
+
 def _get_flags():
+    global g_flags
     if any((x is None for x in (g_case, g_word, g_wrap))):
         _load_settings()
+    # shared by every status, and only built again when flags or settings
+    # change
+    key = (g_case, g_word, g_wrap, g_scope, g_regex)
+    if g_flags[0] == key:
+        return g_flags[1]
     wrap_char = str(g_set.get("wrap_scan_flag_char", Def.WRAP_CHAR))
     wrap_posn = g_set.get("wrap_scan_flag_position", Def.WRAP_POSN)
     if wrap_posn == 1:
@@ -197,7 +304,15 @@ def _get_flags():
     c = "C" if g_case else tilde + "c"
     w = "W" if g_word else tilde + "w"
     x = (wrap_char.upper()) if g_wrap else (tilde + wrap_char.lower())
-    return flags.format(c=c, w=w, x=x)
+    flags = flags.format(c=c, w=w, x=x)
+    if g_regex:
+        # only shown when on, the flag being rarely used
+        flags += "[E]"
+    if g_set.get("scope_filter_selector", Def.SCOPE_SELECTOR):
+        # only shown when there is a selector to filter by
+        flags += "[S]" if g_scope else "[{}s]".format(tilde)
+    g_flags = (key, flags)
+    return flags
 
 
 # --- utilities ---------------------------------------------------------------
@@ -257,6 +372,187 @@ def _simplify_regions(regions):
     return tuple((x.begin(), x.end()) for x in regions)
 
 
+def _line_starts(snapshot):
+    # offsets where lines begin, without a string for each line
+    starts = array.array("L", [0])
+    append = starts.append
+    find = snapshot.find
+    index = find("\n")
+    while index != -1:
+        index += 1
+        append(index)
+        index = find("\n", index)
+    return starts
+
+
+class RegletArray():
+    """
+    Read-only sequence of reglets kept as two arrays of offsets, far more
+    compact than a tuple of tuples for many thousands of regions.
+    """
+    __slots__ = ("begins", "ends")
+
+    def __init__(self, begins, ends):
+        self.begins = begins
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.begins)
+
+    def __getitem__(self, index):
+        return (self.begins[index], self.ends[index])
+
+    def __iter__(self):
+        return zip(self.begins, self.ends)
+
+
+class SelectionBits():
+    """
+    Whether each match is selected, with a Fenwick tree over the bits so that
+    the number selected before a match takes O(log n). While all bits are the
+    same, e.g. in a new ring, neither list nor tree is built.
+    """
+    __slots__ = ("size", "fill", "bits", "tree", "total")
+
+    def __init__(self, size, fill=False):
+        self.size = size
+        self.fill = bool(fill)
+        self.bits = None
+        self.tree = None
+        self.total = size if fill else 0
+
+    @classmethod
+    def from_list(cls, bits):
+        self = cls(len(bits))
+        self._build(list(map(bool, bits)))
+        return self
+
+    def _build(self, bits):
+        n = len(bits)
+        tree = [0] * (n + 1)
+        for i, bit in enumerate(bits, 1):
+            tree[i] += bit
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.bits = bits
+        self.tree = tree
+        self.total = sum(bits)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        if self.bits is None:
+            return itertools.repeat(self.fill, self.size)
+        return iter(self.bits)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __getitem__(self, index):
+        if self.bits is None:
+            if isinstance(index, slice):
+                return [self.fill] * len(range(*index.indices(self.size)))
+            if not -self.size <= index < self.size:
+                raise IndexError(index)
+            return self.fill
+        return self.bits[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            indices = range(*index.indices(self.size))
+            values = list(map(bool, value))
+            if len(values) != len(indices):
+                raise ValueError("cannot resize SelectionBits")
+            self._assign(zip(indices, values))
+            return
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        self._assign(((index, bool(value)),))
+
+    def _assign(self, pairs):
+        # the tree is updated per changed bit, or built again at once when
+        # so many bits change that it would cost less
+        if self.bits is None:
+            self._build([self.fill] * self.size)
+        bits = self.bits
+        changed = [(i, x) for i, x in pairs if bits[i] != x]
+        if len(changed) * self.size.bit_length() > self.size:
+            for i, x in changed:
+                bits[i] = x
+            self._build(bits)
+            return
+        tree = self.tree
+        size = self.size
+        for index, value in changed:
+            # an index can come twice, from slices that overlap
+            if bits[index] == value:
+                continue
+            bits[index] = value
+            delta = 1 if value else -1
+            self.total += delta
+            i = index + 1
+            while i <= size:
+                tree[i] += delta
+                i += i & -i
+
+    def set_slices(self, slices, value):
+        value = bool(value)
+        self._assign((i, value) for s in slices
+                     for i in range(*s.indices(self.size)))
+
+    def flip_runs(self, runs):
+        if self.bits is None:
+            self._build([self.fill] * self.size)
+        bits = self.bits
+        self._assign((i, not bits[i]) for a, b in runs for i in range(a, b))
+
+    def count(self, value):
+        return self.total if value else self.size - self.total
+
+    def rank(self, index, value=True):
+        # the number of bits equal to value before index
+        if self.bits is None:
+            return index if self.fill == value else 0
+        count = 0
+        i = index
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count if value else index - count
+
+    def select(self, k, value=True):
+        # the index of the k-th bit equal to value, counting from 1
+        if self.bits is None:
+            return k - 1
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            i = pos + step
+            if i <= self.size:
+                count = self.tree[i] if value else step - self.tree[i]
+                if count < k:
+                    pos = i
+                    k -= count
+            step >>= 1
+        return pos
+
+    def find_next(self, index, value, reverse=False):
+        # the nearest index after index with a bit equal to value, going
+        # around the ends, or None if there is none
+        total = self.count(value)
+        if not total:
+            return None
+        if reverse:
+            before = self.rank(index, value)
+            return self.select(before or total, value)
+        before = self.rank(index + 1, value)
+        return self.select(before + 1 if before < total else 1, value)
+
+
 def _region_to_reglet(region):
     return (region.begin(), region.end())
 
@@ -306,14 +602,21 @@ def _reset_eqf(eqf):
     eqf.code = Code.NO_CODE
     eqf.text = None
     eqf.pattern = None
+    eqf.change_count = None
     eqf.reverse = None
     eqf.reglets = []
-    eqf.selected = []
+    eqf.selected = SelectionBits(0)
     eqf.init_index = None
     eqf.this_index = None
     eqf.orig_region = None
     eqf.zero_region = None
+    eqf.density = None
+    eqf.sel_cache = getattr(eqf, "sel_cache", None)
+    eqf.undo_stack = collections.deque()
+    eqf.redo_stack = []
+    eqf.history_cost = 0
     eqf.ruler = ""
+    eqf.preview = ""
     eqf.alert = ""
     eqf.notice = ""
 
@@ -345,6 +648,16 @@ class ExactQuickFind():
             return None
         return _reglet_to_region(self.reglets[self.this_index])
 
+    @property
+    def selected(self):
+        return self._selected
+
+    @selected.setter
+    def selected(self, bits):
+        if not isinstance(bits, SelectionBits):
+            bits = SelectionBits.from_list(bits)
+        self._selected = bits
+
     @property
     def this_is_selected(self):
         if not self.reglets:
@@ -363,7 +676,7 @@ class ExactQuickFind():
 
     @property
     def num_selected(self):
-        return sum(self.selected)
+        return self.selected.count(True)
 
     @property
     def status(self):
@@ -374,6 +687,8 @@ class ExactQuickFind():
             status = self.alert + " ! " + status
         if self.ruler:
             status += " @ " + self.ruler
+        elif self.preview:
+            status += " @ " + self.preview
         if show_notice and self.notice:
             status += " : " + self.notice
         return status
@@ -383,15 +698,481 @@ def _get_eqf(view):
     vid = view.id()
     if vid not in g_eqf_center:
         g_eqf_center[vid] = ExactQuickFind(view)
+        g_eqf_center[vid].preview = g_previews.pop(vid, "")
         _debug_print("Created eqf object", vid=vid)
+        _restore_ring(g_eqf_center[vid])
     return g_eqf_center[vid]
 
 
+def _peek_eqf(view):
+    # None until the first command of the plugin in view
+    return g_eqf_center.get(view.id())
+
+
+def _get_idle_status(view):
+    # the status of a view with no eqf object
+    preview = g_previews.get(view.id())
+    return _get_flags() + " @ " + preview if preview else _get_flags()
+
+
 def _del_eqf(view):
     vid = view.id()
     if vid in g_eqf_center:
         del g_eqf_center[vid]
         _debug_print("Deleted eqf object", vid=vid)
+    bid = view.buffer_id()
+    if not any(x.view.buffer_id() == bid for x in g_eqf_center.values()):
+        _del_match_store(bid)
+
+
+# --- match store -------------------------------------------------------------
+
+"""
+Matches are shared by all views into the same buffer, e.g. clones made by
+"New View into File". A store holds the reglets of the buffer at one
+change count, keyed by (pattern, find_flags, selector). Per-view state
+such as the index and selections stays in eqf.
+"""
+
+g_match_store_size = 8
+
+
+def _get_match_store(view):
+    bid = view.buffer_id()
+    change_count = view.change_count()
+    store = g_match_center.get(bid)
+    if store is None or store[0] != change_count:
+        store = g_match_center[bid] = (change_count, collections.OrderedDict())
+    return store[1]
+
+
+def _del_match_store(bid):
+    g_word_indexes.pop(bid, None)
+    g_scope_runs.pop(bid, None)
+    g_line_indexes.pop(bid, None)
+    if g_match_center.pop(bid, None) is not None:
+        _debug_print("Deleted match store of buffer {}".format(bid))
+
+
+def _find_all_shared(view, text):
+    store = _get_match_store(view)
+    key = _get_find_args(text) + (_get_scope_selector(),)
+    if key in store:
+        store.move_to_end(key)
+        _trace_print("Reused matches for \"{}\"".format(key[0]),
+                     vid=view.id())
+    elif g_regex and _check_regex(view, text):
+        return ()
+    else:
+        reglets = _find_with_backend(view, text, len(store))
+        if key[2]:
+            reglets = _filter_by_scope(reglets, _get_scope_runs(view, key[2]))
+        store[key] = reglets
+        if len(store) > g_match_store_size:
+            store.popitem(last=False)
+    return store[key]
+
+
+# --- line index --------------------------------------------------------------
+
+"""
+Offsets where lines begin, built in one pass per buffer version. Rows of
+matches come from merging or bisecting these with the sorted reglets,
+instead of calling view.rowcol() on each match.
+"""
+
+
+def _get_line_starts(view):
+    bid = view.buffer_id()
+    change_count = view.change_count()
+    index = g_line_indexes.get(bid)
+    if index is None or index[0] != change_count:
+        snapshot = view.substr(sublime.Region(0, view.size()))
+        index = g_line_indexes[bid] = (change_count, _line_starts(snapshot))
+    return index[1]
+
+
+def _row_of(starts, point):
+    # 0-based
+    return bisect.bisect_right(starts, point) - 1
+
+
+def _first_per_line(reglets, starts):
+    # ring indices of the first match on each line, in one merge
+    indices = []
+    n = len(starts)
+    j = 0
+    for i, (a, _) in enumerate(reglets):
+        if j < n and a >= starts[j]:
+            while j < n and starts[j] <= a:
+                j += 1
+            indices.append(i)
+    return indices
+
+
+def _indices_to_slices(indices):
+    slices = []
+    for i in indices:
+        if slices and slices[-1].stop == i:
+            slices[-1] = slice(slices[-1].start, i + 1)
+        else:
+            slices.append(slice(i, i + 1))
+    return slices
+
+
+def _first_index_on_row(eqf, starts, row):
+    return bisect.bisect_left(eqf.reglets, (starts[row],))
+
+
+# return the index of the first match on the next line with a match
+def _next_line_index(eqf, starts, reverse):
+    row = _row_of(starts, eqf.this_reglet[0])
+    if reverse:
+        index = _first_index_on_row(eqf, starts, row) - 1
+        if index < 0 and g_wrap:
+            index = eqf.size - 1
+        if index < 0:
+            return None
+        index = _first_index_on_row(
+            eqf, starts, _row_of(starts, eqf.reglets[index][0]))
+    else:
+        index = eqf.size
+        if row + 1 < len(starts):
+            index = _first_index_on_row(eqf, starts, row + 1)
+        if index == eqf.size:
+            if not g_wrap:
+                return None
+            index = 0
+    if _row_of(starts, eqf.reglets[index][0]) == row:
+        return None
+    return index
+
+
+# --- scope filter ------------------------------------------------------------
+
+"""
+With [S], only matches that lie wholly within "scope_filter_selector" are
+kept, e.g. "source - comment - string" for code only. The runs of the
+selector are found once per buffer version, merged, and intersected with
+the sorted reglets in one linear pass.
+"""
+
+
+def _get_scope_selector():
+    if not g_scope:
+        return ""
+    return g_set.get("scope_filter_selector", Def.SCOPE_SELECTOR)
+
+
+def _get_scope_runs(view, selector):
+    bid = view.buffer_id()
+    change_count = view.change_count()
+    cached = g_scope_runs.get(bid)
+    if cached and cached[:2] == (change_count, selector):
+        return cached[2]
+    runs = []
+    for begin, end in sorted(map(_region_to_reglet,
+                                 view.find_by_selector(selector))):
+        if runs and begin <= runs[-1][1]:
+            runs[-1] = (runs[-1][0], max(runs[-1][1], end))
+        else:
+            runs.append((begin, end))
+    g_scope_runs[bid] = (change_count, selector, runs)
+    return runs
+
+
+def _iter_in_scope(reglets, runs):
+    # both are sorted and non-overlapping, so neither index goes back
+    i = 0
+    n = len(runs)
+    for reglet in reglets:
+        while i < n and runs[i][1] < reglet[1]:
+            i += 1
+        if i == n:
+            return
+        if runs[i][0] <= reglet[0]:
+            yield reglet
+
+
+def _filter_by_scope(reglets, runs):
+    return tuple(_iter_in_scope(reglets, runs))
+
+
+# --- regex -------------------------------------------------------------------
+
+"""
+With [E], text is a regular expression for the regex engine of sublime.
+Before a pattern is searched for in a buffer, it is run with view.find()
+over 64K characters at the start, middle and end of the buffer, each up to
+the first match past its end. It is rejected if sublime fails on it, if
+it matches empty text, or if it would take longer than "regex_time_budget"
+on the whole buffer at the rate of the probe. Verdicts are kept per buffer
+version. As the probe can't bound a pattern that backtracks on text it
+doesn't reach, the matches of a new ring with [E] are found on the async
+thread whatever the size of the buffer, probe included. Python re is only
+used where there is no buffer to search, with compiled patterns in an LRU.
+"""
+
+g_regex_cache = collections.OrderedDict()
+g_regex_cache_size = 32
+g_regex_verdicts = collections.OrderedDict()
+g_regex_verdicts_size = 32
+g_regex_probe_size = 1 << 16
+g_regex_probe_matches = 1 << 12
+
+
+def _get_regex(text, case, word, regex):
+    key = (text, case, word, regex)
+    pattern = g_regex_cache.get(key)
+    if pattern is None:
+        pattern = g_regex_cache[key] = compile_pattern(*key)
+        if len(g_regex_cache) > g_regex_cache_size:
+            g_regex_cache.popitem(last=False)
+    else:
+        g_regex_cache.move_to_end(key)
+    return pattern
+
+
+def _probe_regex(view, pattern, find_flags):
+    budget = g_set.get("regex_time_budget", Def.REGEX_TIME_BUDGET) / 1000
+    size = view.size()
+    half = g_regex_probe_size // 2
+    begins = sorted({0, max(size // 2 - half, 0),
+                     max(size - g_regex_probe_size, 0)})
+    scanned = 0
+    reached = 0
+    start = time.perf_counter()
+    for begin in begins:
+        begin = max(begin, reached)
+        end = min(begin + g_regex_probe_size, size)
+        pos = begin
+        for _ in range(g_regex_probe_matches):
+            try:
+                region = view.find(pattern, pos, find_flags)
+            except (ValueError, RuntimeError):
+                return "Invalid Pattern"
+            if region is None or region.a == -1:
+                # sublime has scanned the rest of the buffer
+                pos = size
+                break
+            if region.empty():
+                return "Pattern Matches Empty Text"
+            pos = region.end()
+            if pos >= end:
+                break
+        scanned += pos - begin
+        reached = max(reached, pos)
+        if reached >= size:
+            break
+    elapsed = time.perf_counter() - start
+    if scanned and elapsed * size / scanned > budget:
+        return "Pattern Too Expensive"
+    return ""
+
+
+# return why text can't be searched for as a pattern, or "" if it can
+def _check_regex(view, text):
+    key = (text, g_case, g_word, view.buffer_id(), view.change_count())
+    if key in g_regex_verdicts:
+        g_regex_verdicts.move_to_end(key)
+        return g_regex_verdicts[key]
+    verdict = _probe_regex(view, *_get_find_args(text))
+    g_regex_verdicts[key] = verdict
+    if len(g_regex_verdicts) > g_regex_verdicts_size:
+        g_regex_verdicts.popitem(last=False)
+    if verdict:
+        _debug_print("{} \"{}\"".format(verdict, text), vid=view.id())
+    return verdict
+
+
+# --- backends ----------------------------------------------------------------
+
+"""
+Backends return the reglets of all matches of text under current flags.
+Any backend other than find_all is only used after a differential check
+against find_all on a real search has passed; a backend that ever
+disagrees is disabled for the session. Both are per combination of find
+flags, since case folding and word boundaries of python re may differ
+from those of sublime under some flags only. They differ on non-ascii text
+too, which one check can't cover, so other backends are only used for
+ascii text, and not for text with letters that fold to non-ascii ones when
+ignoring case. Among verified backends, the one with the lowest average
+time per character wins for large buffers.
+
+    find_all    view.find_all(), always available
+    finditer    python re over a snapshot of the buffer
+    str_find    str.find() loop, for [C] and [w] only
+    word_index  lookup in a map of all words in the buffer to the offsets
+                where they begin, for [C][W] and text made of word
+                characters only, built once per change count when a buffer
+                is searched for a second text; indexes of least recently
+                searched buffers are dropped past a total number of words
+"""
+
+g_backend_min_size = 1 << 16
+g_word_index_max_size = 1 << 25
+g_word_re = re.compile(r"\w+")
+g_word_indexes = collections.OrderedDict()
+g_word_indexes_max_words = 1 << 23
+g_backend_timings = {}
+g_backend_verified = set()
+g_backend_disabled = set()
+
+
+def _backend_key(name):
+    return (name, g_case, g_word, g_regex)
+
+
+def _is_verified(name):
+    return name == "find_all" or _backend_key(name) in g_backend_verified
+
+
+def _find_all_backend(view, text, snapshot):
+    return _simplify_regions(view.find_all(*_get_find_args(text)))
+
+
+def _finditer_backend(view, text, snapshot):
+    return tuple(m.span() for m in _compile_pattern(text).finditer(snapshot()))
+
+
+def _str_find_backend(view, text, snapshot):
+    content = snapshot()
+    n = len(text)
+    spans = []
+    i = content.find(text)
+    while i != -1:
+        spans.append((i, i + n))
+        i = content.find(text, i + n)
+    return tuple(spans)
+
+
+def _get_word_index(view, snapshot):
+    bid = view.buffer_id()
+    change_count = view.change_count()
+    index = g_word_indexes.get(bid)
+    if index is not None and index[0] == change_count:
+        g_word_indexes.move_to_end(bid)
+        return index[1]
+    g_word_indexes.pop(bid, None)
+    words = {}
+    num_words = 0
+    for m in g_word_re.finditer(snapshot()):
+        words.setdefault(m.group(), array.array("L")).append(m.start())
+        num_words += 1
+    g_word_indexes[bid] = (change_count, words, num_words)
+    total = sum(x[2] for x in list(g_word_indexes.values()))
+    while total > g_word_indexes_max_words and len(g_word_indexes) > 1:
+        total -= g_word_indexes.popitem(last=False)[1][2]
+    return words
+
+
+def _word_index_backend(view, text, snapshot):
+    # with [C][W], matches of a word are exactly the words equal to it
+    n = len(text)
+    begins = _get_word_index(view, snapshot).get(text, ())
+    return tuple((x, x + n) for x in begins)
+
+
+g_backends = collections.OrderedDict((
+    ("find_all", _find_all_backend),
+    ("finditer", _finditer_backend),
+    ("str_find", _str_find_backend),
+    ("word_index", _word_index_backend)
+))
+
+
+def _eligible_backends(view, text):
+    if g_regex:
+        # python re and the regex engine of sublime differ in syntax
+        return ["find_all"]
+    if not text.isascii() or not (
+            g_case or g_unsafe_fold.isdisjoint(text.lower().encode("ascii"))):
+        return ["find_all"]
+    names = ["find_all", "finditer"]
+    if g_case and not g_word:
+        names.append("str_find")
+    if (g_case and g_word and g_word_re.fullmatch(text)
+            and view.size() <= g_word_index_max_size):
+        names.append("word_index")
+    return [x for x in names if _backend_key(x) not in g_backend_disabled]
+
+
+def _choose_backend(view, text, num_searched):
+    eligible = _eligible_backends(view, text)
+    forced = g_set.get("backend", Def.BACKEND)
+    if forced in eligible:
+        return forced
+    if view.size() < g_backend_min_size:
+        return "find_all"
+    if "word_index" in eligible:
+        index = g_word_indexes.get(view.buffer_id())
+        if num_searched or (index and index[0] == view.change_count()):
+            return "word_index"
+        eligible.remove("word_index")
+    unverified = [x for x in eligible if not _is_verified(x)]
+    if unverified:
+        return unverified[0]
+    return min(eligible, key=lambda x: g_backend_timings.get(x, 0))
+
+
+def _time_backend(name, view, text, snapshot):
+    start = time.perf_counter()
+    reglets = g_backends[name](view, text, snapshot)
+    per_char = (time.perf_counter() - start) / max(view.size(), 1)
+    average = g_backend_timings.get(name)
+    g_backend_timings[name] = (per_char if average is None
+                               else 0.8 * average + 0.2 * per_char)
+    return reglets
+
+
+def _make_snapshot(view):
+    cache = []
+
+    def snapshot():
+        if not cache:
+            cache.append(view.substr(sublime.Region(0, view.size())))
+        return cache[0]
+    return snapshot
+
+
+def _find_with_backend(view, text, num_searched=0):
+    name = _choose_backend(view, text, num_searched)
+    snapshot = _make_snapshot(view)
+    reglets = _time_backend(name, view, text, snapshot)
+    if not _is_verified(name):
+        expected = _time_backend("find_all", view, text, snapshot)
+        if reglets == expected:
+            g_backend_verified.add(_backend_key(name))
+        else:
+            g_backend_disabled.add(_backend_key(name))
+            _debug_print("Disabled backend {} that disagrees with find_all "
+                         "for \"{}\"".format(name, text), level=Level.WARN)
+            reglets = expected
+    _trace_print("Found {} matches with backend {}".format(len(reglets), name),
+                 vid=view.id())
+    return reglets
+
+
+def _verify_backends(view, text):
+    snapshot = _make_snapshot(view)
+    expected = None
+    lines = []
+    for name in _eligible_backends(view, text):
+        start = time.perf_counter()
+        reglets = g_backends[name](view, text, snapshot)
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = reglets
+            result = "{} matches".format(len(reglets))
+        elif reglets == expected:
+            g_backend_verified.add(_backend_key(name))
+            result = "OK"
+        else:
+            g_backend_disabled.add(_backend_key(name))
+            result = "MISMATCH, disabled"
+        lines.append("{:<12} {:>10.3f} ms  {}".format(name, elapsed * 1000,
+                                                      result))
+    return lines
 
 
 # --- init helpers ------------------------------------------------------------
@@ -402,14 +1183,20 @@ def _set_status(eqf):
         if active_view is None:
             _debug_print("Active view is None in Window {}".format(w.id()))
             continue
-        veqf = _get_eqf(active_view)
-        veqf.view.set_status("exact_quick_find_status", veqf.status)
+        status = _show_status(active_view)
         _trace_print("Set status on Window {}: \"{}\""
-                     .format(w.id(), veqf.status), vid=veqf.vid)
+                     .format(w.id(), status), vid=active_view.id())
     eqf.alert = ""
     eqf.notice = ""
 
 
+def _show_status(view):
+    eqf = _peek_eqf(view)
+    status = _get_idle_status(view) if eqf is None else eqf.status
+    view.set_status("exact_quick_find_status", status)
+    return status
+
+
 def _reset_status(eqf):
     _set_status(eqf)
     eqf.ruler = ""
@@ -444,9 +1231,11 @@ def _has_next_region_to_add(eqf):
     if g_wrap:
         return True
     msg = ""
-    if eqf.reverse and all(eqf.selected[:eqf.this_index]):
+    i = eqf.this_index
+    unselected = eqf.size - eqf.num_selected
+    if eqf.reverse and not eqf.selected.rank(i, False):
         msg = "No Matches Above"
-    if not eqf.reverse and all(eqf.selected[eqf.this_index + 1:]):
+    if not eqf.reverse and unselected == eqf.selected.rank(i + 1, False):
         msg = "No Matches Below"
     if msg:
         eqf.alert = msg
@@ -456,7 +1245,7 @@ def _has_next_region_to_add(eqf):
 
 
 def _move_to_next_region_to_add(eqf):
-    if all(eqf.selected):
+    if eqf.num_selected == eqf.size:
         plural = "es" if eqf.size > 1 else ""
         msg = "Already Added All {} Match{}".format(eqf.size, plural)
         eqf.alert = msg
@@ -464,19 +1253,18 @@ def _move_to_next_region_to_add(eqf):
         return
     if not _has_next_region_to_add(eqf):
         return
-    while True:
-        _to_next_region(eqf)
-        if not eqf.this_is_selected:
-            break
+    eqf.this_index = eqf.selected.find_next(eqf.this_index, False,
+                                            eqf.reverse)
 
 
 def _has_next_added_region(eqf):
     if g_wrap:
         return True
     msg = ""
-    if eqf.reverse and not any(eqf.selected[:eqf.this_index]):
+    i = eqf.this_index
+    if eqf.reverse and not eqf.selected.rank(i):
         msg = "No Selections Above"
-    if not eqf.reverse and not any(eqf.selected[eqf.this_index + 1:]):
+    if not eqf.reverse and eqf.num_selected == eqf.selected.rank(i + 1):
         msg = "No Selections Below"
     if msg:
         eqf.alert = msg
@@ -486,7 +1274,7 @@ def _has_next_added_region(eqf):
 
 
 def _move_to_next_added_region(eqf):
-    if not any(eqf.selected):
+    if not eqf.num_selected:
         msg = "No Selections"
         eqf.alert = msg
         _debug_print(msg, vid=eqf.vid)
@@ -494,31 +1282,38 @@ def _move_to_next_added_region(eqf):
     if not _has_next_added_region(eqf):
         return
     prev_index = eqf.this_index
-    while True:
-        _to_next_region(eqf)
-        if eqf.this_is_selected:
-            break
+    eqf.this_index = eqf.selected.find_next(prev_index, True, eqf.reverse)
     if eqf.this_index == prev_index:
         msg = "No Other Selections"
         eqf.alert = msg
         _debug_print(msg, vid=eqf.vid)
 
 
-def _establish_matches(eqf):
+def _get_find_args(text):
     find_flags = 0
     if not g_case:
         find_flags |= sublime.IGNORECASE
-    pattern = eqf.text
+    pattern = text
     if g_word:
-        pattern = "\\b{}\\b".format(re.escape(eqf.text))
-    else:
+        pattern = word_pattern(text, g_regex)
+    elif not g_regex:
         find_flags |= sublime.LITERAL
-    eqf.pattern = pattern
-    all_regions = eqf.view.find_all(eqf.pattern, find_flags)
-    if not all_regions:
+    return pattern, find_flags
+
+
+def _establish_matches(eqf):
+    if g_regex:
+        msg = _check_regex(eqf.view, eqf.text)
+        if msg:
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return False
+    eqf.pattern = _get_find_args(eqf.text)[0]
+    eqf.change_count = eqf.view.change_count()
+    eqf.reglets = _find_all_shared(eqf.view, eqf.text)
+    if not eqf.reglets:
         return False
-    eqf.reglets = _simplify_regions(all_regions)
-    eqf.selected = [False] * eqf.size
+    eqf.selected = SelectionBits(eqf.size, False)
     return True
 
 
@@ -567,12 +1362,14 @@ def _establish_index(eqf, region, point):
             select=gn or an,
             comp_select=False)
     if aa:
-        eqf.selected = [True] * eqf.size
+        eqf.selected = SelectionBits(eqf.size, True)
     elif ss:
         if reglet != eqf.this_reglet:
-            _debug_assert(g_word, "Expect [W]")
+            _debug_assert(g_word or g_regex, "Expect [W] or [E]")
             msg = ("Selection \"{}\" Not In A Whole Word"
                    .format(_abridge(eqf.text)))
+            if g_regex:
+                msg = "Selection Not A Match"
             eqf.alert = msg
             _debug_print(msg, vid=eqf.vid)
             return False
@@ -605,7 +1402,7 @@ def _establish_regions(eqf):
 # --- init --------------------------------------------------------------------
 
 # return True for success, False for failure
-def _basic_init(eqf):
+def _basic_init(eqf, text=None):
     def _pre_check(unwanted, msg):
         if unwanted:
             eqf.alert = msg
@@ -634,18 +1431,19 @@ def _basic_init(eqf):
         _pre_check(point and eqf.code == Code.SUBTRACT_THIS, "Can't Subtract"),
             _pre_check(eqf.code == Code.GO_BACK, "Can't Go Back"))):
         return False
-    # 0. expand point selection
-    if point:
+    # 0. expand point selection, unless text is typed
+    if point and text is None:
         eqf.view.run_command("expand_selection", {"to": "word"})
         region = eqf.view.sel()[-1]
         if region.empty():
             return False
-    eqf.text = eqf.view.substr(region)
+    eqf.text = eqf.view.substr(region) if text is None else text
     # 1. establish matches
     if not _establish_matches(eqf):
-        msg = "No Matches Found For \"{}\"".format(_abridge(eqf.text))
-        eqf.alert = msg
-        _debug_print(msg, vid=eqf.vid)
+        if not eqf.alert:
+            msg = "No Matches Found For \"{}\"".format(_abridge(eqf.text))
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
         return False
     # 2. establish index
     if not _establish_index(eqf, region, point=point):
@@ -660,21 +1458,46 @@ def _basic_init(eqf):
     return True
 
 
+def _sel_fingerprint(view):
+    # cheap stand-in for the whole selection, None if there is none
+    sel = view.sel()
+    n = len(sel)
+    if n == 0:
+        return None
+    return (n, _region_to_reglet(sel[0]), _region_to_reglet(sel[-1]),
+            view.change_count())
+
+
+def _read_sel_reglets(view):
+    begins = array.array("q")
+    ends = array.array("q")
+    for region in view.sel():
+        begins.append(region.begin())
+        ends.append(region.end())
+    return RegletArray(begins, ends)
+
+
 # return True for success, False for failure
 def _extended_init(eqf):
     # --- WRONG -------------
     # if not eqf.view.sel():
     # -----------------------
     # eqf.view.sel() evaluates to True even if there are no selections
-    if len(eqf.view.sel()) == 0:
+    fingerprint = _sel_fingerprint(eqf.view)
+    if fingerprint is None:
         msg = "No Selections"
         eqf.alert = msg
         _debug_print(msg, vid=eqf.vid)
         return False
-    eqf.reglets = _simplify_regions(eqf.view.sel())
+    # selections are read once and reused until they change
+    if eqf.sel_cache is None or eqf.sel_cache[0] != fingerprint:
+        eqf.sel_cache = (fingerprint, _read_sel_reglets(eqf.view))
+        _trace_print("Read {} selections".format(fingerprint[0]),
+                     vid=eqf.vid)
+    eqf.reglets = eqf.sel_cache[1]
     eqf.this_index = 0 if eqf.reverse else eqf.size - 1
     eqf.init_index = eqf.size - 1 if eqf.reverse else 0
-    eqf.selected = [True] * eqf.size
+    eqf.selected = SelectionBits(eqf.size, True)
     eqf.init = Init.EXTENDED
     return True
 
@@ -682,7 +1505,7 @@ def _extended_init(eqf):
 # --- dispatch helpers --------------------------------------------------------
 
 def _push_zero_region(eqf):
-    if any(eqf.selected):
+    if eqf.num_selected:
         return
     eqf.zero_region = eqf.this_region
     eqf.view.sel().add(eqf.zero_region)
@@ -710,6 +1533,14 @@ def _subtract_this_region(eqf):
     eqf.this_is_selected = False
 
 
+def _sync_selected_regions(eqf):
+    # rebuild the editor selection from eqf.selected in one batch
+    eqf.zero_region = None
+    eqf.view.sel().clear()
+    _add_selected_regions(eqf)
+    _push_zero_region(eqf)
+
+
 def _substract_region_avoid_zero(eqf):
     _subtract_this_region(eqf)
     _push_zero_region(eqf)
@@ -755,7 +1586,7 @@ def _add_all_dispatch(eqf):
         _debug_print(msg, vid=eqf.vid)
         return
     _pop_zero_region(eqf)
-    eqf.selected = [True] * eqf.size
+    eqf.selected = SelectionBits(eqf.size, True)
     _add_selected_regions(eqf)
 
 
@@ -793,7 +1624,7 @@ def _single_select_this_dispatch(eqf):
         return
     # even selections outside the ring will be cleared
     eqf.view.sel().clear()
-    eqf.selected = [False] * eqf.size
+    eqf.selected = SelectionBits(eqf.size, False)
     _add_this_region(eqf)
 
 
@@ -810,7 +1641,7 @@ def _invert_select_this_dispatch(eqf):
         return
     _pop_zero_region(eqf)
     _subtract_this_region(eqf)
-    eqf.selected = [True] * eqf.size
+    eqf.selected = SelectionBits(eqf.size, True)
     eqf.this_is_selected = False
     _add_selected_regions(eqf)
 
@@ -843,10 +1674,1030 @@ g_dispatches = (
 )
 
 
+g_peek_codes = frozenset((Code.PEEK_NEXT, Code.PEEK_NEXT_SELECTED))
+
+
 def _dispatch(eqf):
     return g_dispatches[eqf.code](eqf)
 
 
+# --- bulk --------------------------------------------------------------------
+
+def _ring_range(eqf, begin, end):
+    # slice of ring indices whose matches start within [begin, end)
+    return slice(bisect.bisect_left(eqf.reglets, (begin,)),
+                 bisect.bisect_left(eqf.reglets, (end,)))
+
+
+def _selected_lines_slices(eqf):
+    spans = []
+    for region in eqf.view.sel():
+        line = eqf.view.line(region)
+        if spans and line.begin() <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], line.end())
+        else:
+            spans.append([line.begin(), line.end()])
+    return [_ring_range(eqf, a, b) for a, b in spans]
+
+
+def _bulk_slices(eqf, where, start, stop, step):
+    if where == "visible":
+        region = eqf.view.visible_region()
+        return [_ring_range(eqf, region.begin(), region.end())]
+    if where == "lines":
+        return _selected_lines_slices(eqf)
+    if where == "first_per_line":
+        starts = _get_line_starts(eqf.view)
+        return _indices_to_slices(_first_per_line(eqf.reglets, starts))
+    # 1-based and inclusive, as shown in ruler
+    start = 1 if start is None else max(start, 1)
+    stop = eqf.size if stop is None else min(stop, eqf.size)
+    return [slice(start - 1, stop, max(step, 1))]
+
+
+# return number of matches whose selection state is changed
+def _bulk_select(eqf, slices, value):
+    before = eqf.num_selected
+    eqf.selected.set_slices(slices, value)
+    return abs(eqf.num_selected - before)
+
+
+g_range_re = re.compile(r"^\s*(\d*)\s*(?:-\s*(\d*))?\s*(?:/\s*(\d+))?\s*$")
+
+
+def _parse_range(text):
+    m = g_range_re.match(text)
+    if not m or not any(m.groups()):
+        return None
+    start, stop, step = (int(x) if x else None for x in m.groups())
+    if m.group(2) is None and "-" not in text:
+        stop = start
+    return {"start": start, "stop": stop, "step": step or 1}
+
+
+# --- per cursor --------------------------------------------------------------
+
+"""
+Every cursor moves to the next match of its own text, or of the word under
+it. Cursors are grouped by text so that each distinct text is searched for
+once, through the match store, and each successor is found by bisect.
+"""
+
+
+def _group_cursors(view):
+    groups = collections.OrderedDict()
+    for region in view.sel():
+        if region.empty():
+            region = view.word(region)
+        text = view.substr(region)
+        groups.setdefault(text if text.strip() else None, []).append(region)
+    return groups
+
+
+# return number of cursors moved
+def _goto_per_cursor(view, reverse):
+    moved = 0
+    dests = []
+    for text, regions in _group_cursors(view).items():
+        reglets = () if text is None else _find_all_shared(view, text)
+        for region in regions:
+            dest = _next_in_reglets(reglets, region, reverse)
+            if dest is None and g_wrap and reglets:
+                dest = reglets[-1] if reverse else reglets[0]
+            if dest is None or dest == _region_to_reglet(region):
+                dests.append(region)
+            else:
+                dests.append(_reglet_to_region(dest))
+                moved += 1
+    if moved:
+        view.sel().clear()
+        view.sel().add_all(dests)
+        view.show(view.sel()[0] if reverse else view.sel()[-1])
+    return moved
+
+
+# --- replace -----------------------------------------------------------------
+
+# return (begin, end, text) of one edit covering all the selected matches,
+# and the regions of the replaced text after the edit
+def _build_replacement(eqf, replacement):
+    reglets = [x for x, y in zip(eqf.reglets, eqf.selected) if y]
+    begin = reglets[0][0]
+    end = reglets[-1][1]
+    snapshot = eqf.view.substr(sublime.Region(begin, end))
+    parts = []
+    regions = []
+    last = begin
+    shift = 0
+    n = len(replacement)
+    for a, b in reglets:
+        parts.append(snapshot[last - begin:a - begin])
+        parts.append(replacement)
+        regions.append(sublime.Region(a + shift, a + shift + n))
+        shift += n - (b - a)
+        last = b
+    return begin, end, "".join(parts), regions
+
+
+# --- history -----------------------------------------------------------------
+
+"""
+Each history entry is (runs, prev_index, next_index), where runs are the
+index ranges [a, b) whose selection state flipped. Undo and redo flip the
+same runs back and forth. The cost of an entry is its number of runs.
+"""
+
+
+def _xor_runs(old_bits, new_bits):
+    if old_bits == new_bits:
+        return ()
+    n = len(new_bits)
+    diff = (int.from_bytes(old_bits, "little")
+            ^ int.from_bytes(new_bits, "little")).to_bytes(n, "little")
+    runs = []
+    a = diff.find(1)
+    while a != -1:
+        b = diff.find(0, a)
+        if b == -1:
+            b = n
+        runs.append((a, b))
+        a = diff.find(1, b)
+    return tuple(runs)
+
+
+def _flip_runs(eqf, runs):
+    eqf.selected.flip_runs(runs)
+
+
+# return None if history is off
+def _snapshot_history(eqf):
+    if not g_set.get("selection_history_limit", Def.HISTORY_LIMIT):
+        return None
+    return bytes(eqf.selected), eqf.this_index
+
+
+def _record_history(eqf, snapshot):
+    if snapshot is None:
+        return
+    bits, index = snapshot
+    runs = _xor_runs(bits, bytes(eqf.selected))
+    # moves that do not change selections are not recorded
+    if not runs:
+        return
+    eqf.undo_stack.append((runs, index, eqf.this_index))
+    eqf.history_cost += len(runs)
+    eqf.history_cost -= sum(len(x[0]) for x in eqf.redo_stack)
+    eqf.redo_stack = []
+    limit = g_set.get("selection_history_limit", Def.HISTORY_LIMIT)
+    while eqf.history_cost > limit and eqf.undo_stack:
+        eqf.history_cost -= len(eqf.undo_stack.popleft()[0])
+
+
+def _step_history(eqf, undo):
+    src, dst = ((eqf.undo_stack, eqf.redo_stack) if undo
+                else (eqf.redo_stack, eqf.undo_stack))
+    if not eqf.init or not src:
+        msg = "Nothing To Undo" if undo else "Nothing To Redo"
+        eqf.alert = msg
+        _debug_print(msg, vid=eqf.vid)
+        return False
+    entry = src.pop()
+    runs, prev_index, next_index = entry
+    _flip_runs(eqf, runs)
+    eqf.this_index = prev_index if undo else next_index
+    dst.append(entry)
+    _sync_selected_regions(eqf)
+    return True
+
+
+# --- export ------------------------------------------------------------------
+
+g_export_chunk_size = 4096
+
+
+def _iter_match_records(reglets, snapshot, starts):
+    row = 0
+    nrows = len(starts)
+    for a, b in reglets:
+        row = bisect.bisect_right(starts, a, lo=row) - 1
+        begin = starts[row]
+        end = starts[row + 1] - 1 if row + 1 < nrows else len(snapshot)
+        yield "{}:{}: {}\n".format(row + 1, a - begin + 1, snapshot[begin:end])
+
+
+def _append_to_view(view, characters):
+    view.run_command("append", {"characters": characters, "force": True,
+                                "scroll_to_end": False})
+
+
+def _export_matches(out, reglets, snapshot):
+    starts = _line_starts(snapshot)
+    records = _iter_match_records(reglets, snapshot, starts)
+    while True:
+        chunk = "".join(itertools.islice(records, g_export_chunk_size))
+        if not chunk or not out.is_valid():
+            break
+        _append_to_view(out, chunk)
+
+
+# return (text, reglets) of the ring, or of the selection if there is no ring
+def _get_view_matches(eqf):
+    if eqf.init:
+        return eqf.text, eqf.reglets
+    if len(eqf.view.sel()) == 0:
+        return None, ()
+    region = eqf.view.sel()[-1]
+    if region.empty():
+        region = eqf.view.word(region)
+    text = eqf.view.substr(region)
+    if not text.strip():
+        return None, ()
+    return text, _find_all_shared(eqf.view, text)
+
+
+def _describe_matches(text):
+    # text is None for an extended ring, i.e. made of selections
+    if text is None:
+        return "selections"
+    return "\"{}\"".format(_abridge(text))
+
+
+# --- density -----------------------------------------------------------------
+
+def _bin_edges(starts, nbins):
+    # bins of (nearly) equal numbers of lines, as (first_row, offset) pairs
+    nrows = len(starts)
+    step = max(-(-nrows // nbins), 1)
+    return [(row, starts[row]) for row in range(0, nrows, step)]
+
+
+def _bin_counts(reglets, offsets):
+    # number of matches starting at or after each offset, minus the next
+    if numpy is not None:
+        begins = numpy.array(reglets, dtype=numpy.int64).reshape(-1, 2)[:, 0]
+        index = numpy.searchsorted(begins, offsets).tolist()
+    else:
+        begins = array.array("q", map(operator.itemgetter(0), reglets))
+        index = [bisect.bisect_left(begins, x) for x in offsets]
+    index.append(len(reglets))
+    return [index[i + 1] - index[i] for i in range(len(offsets))]
+
+
+def _get_density(eqf, reglets):
+    nbins = g_set.get("density_bins", Def.DENSITY_BINS)
+    # recompute only when the match set changes
+    if (eqf.density is not None and eqf.density[0] is reglets
+            and eqf.density[1] == nbins):
+        return eqf.density[2]
+    starts = _get_line_starts(eqf.view)
+    edges = _bin_edges(starts, nbins)
+    counts = _bin_counts(reglets, [x[1] for x in edges])
+    rows = [x[0] for x in edges] + [len(starts)]
+    density = [(rows[i] + 1, rows[i + 1], counts[i])
+               for i in range(len(counts))]
+    eqf.density = (reglets, nbins, density)
+    return density
+
+
+def _format_density(density, width=40, marker=None):
+    peak = max(x[2] for x in density) or 1
+    digits = len(str(density[-1][1]))
+    lines = []
+    for first, last, count in density:
+        bar = "#" * -(-count * width // peak)
+        mark = " <" if marker is not None and first <= marker <= last else ""
+        lines.append("{:>{d}}-{:<{d}} |{:<{w}}| {}{}".format(
+            first, last, bar, count, mark, d=digits, w=width))
+    return "\n".join(lines) + "\n"
+
+
+# --- list --------------------------------------------------------------------
+
+"""
+The quick panel lists one page of the ring at a time, with entries to load
+the page above or below, so that opening it costs the same for any number
+of matches. Lines are only read for the matches on the page.
+"""
+
+g_list_page_size = 1000
+
+
+def _list_page_start(eqf):
+    # the page with this_index in the middle
+    start = max(eqf.this_index - g_list_page_size // 2, 0)
+    return min(start, max(eqf.size - g_list_page_size, 0))
+
+
+# return quick panel items of a page, and what each of them stands for:
+# ("match", ring index) or ("page", start of another page)
+def _list_page(eqf, start):
+    n = eqf.size
+    stop = min(start + g_list_page_size, n)
+    items = []
+    targets = []
+    if start > 0:
+        items.append("^ {} More Above".format(start))
+        targets.append(("page", max(start - g_list_page_size, 0)))
+    for i in range(start, stop):
+        region = _reglet_to_region(eqf.reglets[i])
+        row, col = eqf.view.rowcol(region.begin())
+        line = eqf.view.substr(eqf.view.line(region)).strip()
+        items.append("{} {}/{}  {}:{}  {}".format(
+            "+" if eqf.selected[i] else " ", i + 1, n, row + 1, col + 1,
+            _abridge(line, 80)))
+        targets.append(("match", i))
+    if stop < n:
+        items.append("v {} More Below".format(n - stop))
+        targets.append(("page", stop))
+    return items, targets
+
+
+def _go_to_listed(eqf, index):
+    if eqf.code not in {Code.GO_FIRST, Code.GO_BACK}:
+        eqf.last_code = eqf.code
+    eqf.code = Code.GO_FIRST
+    snapshot = _snapshot_history(eqf)
+    _context_aware_go(eqf, dest_index=index, notice_name="There")
+    _record_history(eqf, snapshot)
+    _finalize(eqf)
+
+
+# --- window ring -------------------------------------------------------------
+
+g_max_workers = 4
+
+
+def _get_executor():
+    global g_executor
+    if g_executor is None:
+        g_executor = concurrent.futures.ThreadPoolExecutor(g_max_workers)
+    return g_executor
+
+
+def _scan_view(view, text, regex, selector):
+    if regex is None:
+        # a pattern for the regex engine of sublime
+        reglets = _simplify_regions(view.find_all(*_get_find_args(text)))
+    else:
+        snapshot = view.substr(sublime.Region(0, view.size()))
+        reglets = tuple(m.span() for m in regex.finditer(snapshot))
+    if selector:
+        reglets = _filter_by_scope(reglets, _get_scope_runs(view, selector))
+    return reglets
+
+
+def _get_view_scan(view, text):
+    # scans run in the thread pool and are reused until the buffer changes
+    selector = _get_scope_selector()
+    key = (text, g_case, g_word, g_regex, selector)
+    change_count = view.change_count()
+    scan = g_view_scans.get(view.id())
+    if scan is None or scan[0] != key or scan[1] != change_count:
+        regex = None if g_regex else _compile_pattern(text)
+        future = _get_executor().submit(_scan_view, view, text, regex,
+                                        selector)
+        scan = g_view_scans[view.id()] = (key, change_count, future)
+    return scan[2]
+
+
+def _next_in_reglets(reglets, region, reverse):
+    if not reglets:
+        return None
+    if reverse:
+        index = bisect.bisect_left(reglets, (region.begin(),)) - 1
+        return reglets[index] if index >= 0 else None
+    index = bisect.bisect_left(reglets, (region.end(),))
+    return reglets[index] if index < len(reglets) else None
+
+
+def _window_order(views, view, reverse):
+    # views to visit after view, ending with view itself if wrapping
+    i = views.index(view)
+    if reverse:
+        order = views[i - 1::-1] if i else []
+        wrapped = views[:i:-1]
+    else:
+        order = views[i + 1:]
+        wrapped = views[:i]
+    if g_wrap:
+        order += wrapped + [view]
+    return order
+
+
+def _goto_in_window(eqf, reverse):
+    view = eqf.view
+    if len(view.sel()) == 0:
+        return "No Selections"
+    region = view.sel()[-1]
+    if region.empty():
+        region = view.word(region)
+    text = view.substr(region)
+    if not text.strip():
+        return "No Selections"
+    if g_regex and _check_regex(view, text):
+        return _check_regex(view, text)
+    window = view.window()
+    views = window.views()
+    others = _window_order(views, view, reverse)
+    # prefetch all the other views while searching this one
+    for other in others:
+        if other != view:
+            _get_view_scan(other, text)
+    reglets = _find_all_shared(view, text)
+    dest = _next_in_reglets(reglets, region, reverse)
+    if dest is None:
+        for other in others:
+            if other == view:
+                reglets = _find_all_shared(view, text)
+            else:
+                reglets = _get_view_scan(other, text).result()
+            if reglets:
+                view = other
+                dest = reglets[-1] if reverse else reglets[0]
+                break
+    if dest is None:
+        return "No Matches Found In Window"
+    if view != eqf.view:
+        window.focus_view(view)
+    view.sel().clear()
+    view.sel().add(_reglet_to_region(dest))
+    view.show(_reglet_to_region(dest))
+    return ""
+
+
+# --- project -----------------------------------------------------------------
+
+"""
+Files in the window's folders are visited in sorted path order. A file is
+scanned from a read-only memory map: for case-sensitive search, files
+without the utf-8 bytes of the text are skipped without decoding. Matches
+are kept as (row, col, length), 1-based as in encoded positions, and
+cached per file until its mtime or size changes, in an LRU bounded by
+files and by matches.
+"""
+
+g_project_lookahead = 32
+g_file_scans_size = 1024
+g_file_scans_max_matches = 1 << 20
+g_file_scans_matches = 0
+g_file_scans_lock = threading.Lock()
+
+
+def _get_file_scan(path):
+    with g_file_scans_lock:
+        scan = g_file_scans.get(path)
+        if scan is not None:
+            g_file_scans.move_to_end(path)
+        return scan
+
+
+def _put_file_scan(path, scan):
+    global g_file_scans_matches
+    with g_file_scans_lock:
+        old = g_file_scans.pop(path, None)
+        if old is not None:
+            g_file_scans_matches -= len(old[3])
+        g_file_scans[path] = scan
+        g_file_scans_matches += len(scan[3])
+        while len(g_file_scans) > 1 and (
+                len(g_file_scans) > g_file_scans_size
+                or g_file_scans_matches > g_file_scans_max_matches):
+            old = g_file_scans.popitem(last=False)[1]
+            g_file_scans_matches -= len(old[3])
+
+
+def _clear_file_scans():
+    global g_file_scans_matches
+    with g_file_scans_lock:
+        g_file_scans.clear()
+        g_file_scans_matches = 0
+
+
+def _is_excluded(name, patterns):
+    return any(fnmatch.fnmatch(name, x) for x in patterns)
+
+
+def _list_project_files(window, settings):
+    folder_excludes = settings.get("folder_exclude_patterns", [])
+    file_excludes = (settings.get("file_exclude_patterns", [])
+                     + settings.get("binary_file_patterns", []))
+    paths = []
+    for folder in window.folders():
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [x for x in dirs if not _is_excluded(x, folder_excludes)]
+            paths.extend(os.path.join(root, x) for x in files
+                         if not _is_excluded(x, file_excludes))
+    paths.sort()
+    return paths
+
+
+def _read_file_text(path, needle, max_size):
+    size = os.path.getsize(path)
+    if size == 0 or size > max_size:
+        return None
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if needle is not None and mm.find(needle) == -1:
+                return None
+            if mm.find(b"\0", 0, 8192) != -1:
+                return None
+            try:
+                content = mm[:].decode("utf-8")
+            except UnicodeDecodeError:
+                return None
+    # offsets as in a sublime buffer, where line endings are normalized
+    return content.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _scan_file(path, key, regex, max_size):
+    try:
+        stat = os.stat(path)
+        scan = _get_file_scan(path)
+        if (scan is not None and scan[0] == key
+                and scan[1:3] == (stat.st_mtime, stat.st_size)):
+            return scan[3]
+        text, case, word, regex_mode = key
+        needle = text.encode("utf-8") if case and not regex_mode else None
+        content = _read_file_text(path, needle, max_size)
+        matches = ()
+        if content is not None:
+            starts = _line_starts(content)
+            spans = [m.span() for m in regex.finditer(content)]
+            matches = tuple(_span_to_position(starts, a, b) for a, b in spans)
+        _put_file_scan(path, (key, stat.st_mtime, stat.st_size, matches))
+        return matches
+    except OSError:
+        return ()
+
+
+def _span_to_position(starts, a, b):
+    row = bisect.bisect_right(starts, a) - 1
+    return (row + 1, a - starts[row] + 1, b - a)
+
+
+def _iter_file_scans(paths, key, regex, max_size):
+    # stream (path, matches) in order while the pool scans ahead
+    executor = _get_executor()
+    pending = collections.deque()
+    paths = iter(paths)
+    for path in itertools.islice(paths, g_project_lookahead):
+        pending.append((path, executor.submit(_scan_file, path, key, regex,
+                                              max_size)))
+    while pending:
+        path, future = pending.popleft()
+        for x in itertools.islice(paths, 1):
+            pending.append((x, executor.submit(_scan_file, x, key, regex,
+                                               max_size)))
+        yield path, future.result()
+
+
+def _project_order(paths, path, reverse):
+    # paths to visit after path, ending with path itself if wrapping
+    if path in paths:
+        i = paths.index(path)
+        before, after = paths[:i], paths[i + 1:]
+    else:
+        i = bisect.bisect_left(paths, path or "")
+        before, after = paths[:i], paths[i:]
+    if reverse:
+        order, wrapped = before[::-1], after[::-1]
+    else:
+        order, wrapped = after, before
+    if g_wrap:
+        order += wrapped
+    return order
+
+
+def _find_in_project(window, settings, path, text, reverse):
+    key = (text, g_case, g_word, g_regex)
+    regex = _compile_pattern(text)
+    max_size = g_set.get("project_max_file_size", Def.PROJECT_MAX_FILE_SIZE)
+    paths = _project_order(_get_project_candidates(window, settings, text),
+                           path, reverse)
+    for x, matches in _iter_file_scans(paths, key, regex, max_size):
+        if matches:
+            return x, (matches[-1] if reverse else matches[0])
+    return None, None
+
+
+def _get_project_candidates(window, settings, text):
+    if g_regex or not g_set.get("project_trigram_index", Def.TRIGRAM_INDEX):
+        return _list_project_files(window, settings)
+    folders = tuple(window.folders())
+    with g_trigram_lock:
+        index = g_trigram_index
+        if index is None or index.folders != folders:
+            index = None
+        else:
+            start = time.perf_counter()
+            candidates = index.candidates(text, g_case)
+            if candidates is None:
+                # too short to narrow down
+                candidates = set(index.file_paths())
+            # files saved since the last update, which the index may miss
+            candidates.update(x for x in g_trigram_dirty
+                              if _is_in_folders(x, folders))
+            g_trigram_stats["query_time"] = time.perf_counter() - start
+            g_trigram_stats["query_text"] = text
+            g_trigram_stats["query_size"] = len(candidates)
+    if index is None or _is_trigram_index_stale():
+        _update_trigram_index(window, settings)
+    if index is None:
+        return _list_project_files(window, settings)
+    return sorted(candidates)
+
+
+def _select_position(view, position):
+    if view.is_loading():
+        sublime.set_timeout(lambda: _select_position(view, position), 50)
+        return
+    row, col, length = position
+    begin = view.text_point(row - 1, col - 1)
+    region = sublime.Region(begin, begin + length)
+    view.sel().clear()
+    view.sel().add(region)
+    view.show(region)
+
+
+def _open_position(window, path, position):
+    view = window.find_open_file(path)
+    if view is None:
+        encoded = "{}:{}:{}".format(path, position[0], position[1])
+        view = window.open_file(encoded, sublime.ENCODED_POSITION)
+    else:
+        window.focus_view(view)
+    _select_position(view, position)
+
+
+def _goto_in_project(eqf, reverse):
+    view = eqf.view
+    if len(view.sel()) == 0:
+        return "No Selections"
+    region = view.sel()[-1]
+    if region.empty():
+        region = view.word(region)
+    text = view.substr(region)
+    if not text.strip():
+        return "No Selections"
+    if g_regex:
+        # files on disk could only be searched with python re, which
+        # differs from the regex engine of sublime
+        return "Regex Not Supported In Project"
+    # the current file is searched in its buffer, which may be unsaved
+    reglets = _find_all_shared(view, text)
+    dest = _next_in_reglets(reglets, region, reverse)
+    if dest is not None:
+        view.sel().clear()
+        view.sel().add(_reglet_to_region(dest))
+        view.show(_reglet_to_region(dest))
+        return ""
+    window = view.window()
+    settings = view.settings()
+    path = view.file_name()
+
+    def search():
+        found, position = _find_in_project(window, settings, path, text,
+                                           reverse)
+        if found is not None:
+            sublime.set_timeout(
+                lambda: _open_position(window, found, position), 0)
+        elif g_wrap and reglets:
+            dest = reglets[-1] if reverse else reglets[0]
+            position = _reglet_to_position(view, dest)
+            sublime.set_timeout(lambda: _select_position(view, position), 0)
+        else:
+            sublime.status_message("Exact Quick Find: No Matches Found In "
+                                   "Project For \"{}\"".format(_abridge(text)))
+    sublime.set_timeout_async(search, 0)
+    return ""
+
+
+def _reglet_to_position(view, reglet):
+    row, col = view.rowcol(reglet[0])
+    return (row + 1, col + 1, reglet[1] - reglet[0])
+
+
+# --- trigram index -----------------------------------------------------------
+
+"""
+An optional on-disk index from trigrams to the project files containing
+them, used to narrow down the files that "Goto Next In Project" has to
+scan. Trigrams are taken from file bytes with ascii letters lowercased,
+so one index serves both case-sensitive and case-insensitive search.
+
+Queries only read the index, with the list of files and their mtimes kept
+from its last update, plus the files saved since. Once that update is
+older than a refresh interval, a query also starts another one in the
+background, which walks the folders and rescans only files that changed.
+
+The file is a header followed by arrays that are read in place from a
+memory map:
+
+    mtimes        d  per file
+    sizes         Q  per file
+    path_offsets  Q  nfiles + 1 offsets into paths
+    paths         B  utf-8 paths
+    fwd_offsets   Q  nfiles + 1 offsets into fwd
+    fwd           I  sorted trigrams of each file, to update incrementally
+    keys          I  sorted trigrams
+    post_offsets  Q  nkeys + 1 offsets into postings
+    postings      I  sorted file ids of each trigram
+"""
+
+g_index_magic = b"EQFTRI01"
+g_index_sections = (("mtimes", "d"), ("sizes", "Q"), ("path_offsets", "Q"),
+                    ("paths", "B"), ("fwd_offsets", "Q"), ("fwd", "I"),
+                    ("keys", "I"), ("post_offsets", "Q"), ("postings", "I"))
+g_index_header = struct.Struct("<8sII" + "QQ" * len(g_index_sections))
+# ascii letters that match non-ascii ones when ignoring case, e.g. "k" and
+# the kelvin sign, so they can't be used to narrow down such searches
+g_unsafe_fold = frozenset(b"iks")
+# seconds before a query starts another walk of the project folders
+g_trigram_refresh_interval = 60
+
+
+def _to_trigrams(data):
+    return set(zip(data, data[1:], data[2:]))
+
+
+def _trigram_key(gram):
+    return gram[0] << 16 | gram[1] << 8 | gram[2]
+
+
+def _file_trigrams(path, max_size):
+    keys = array.array("I")
+    if os.path.getsize(path) > max_size:
+        return keys
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return keys
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm.find(b"\0", 0, 8192) != -1:
+                return keys
+            data = mm[:].lower()
+    keys.extend(sorted(map(_trigram_key, _to_trigrams(data))))
+    return keys
+
+
+def _query_trigrams(text, case):
+    grams = _to_trigrams(text.encode("utf-8").lower())
+    # line endings are normalized when scanning but not when indexing
+    grams = [x for x in grams if 10 not in x and 13 not in x]
+    if not case:
+        grams = [x for x in grams
+                 if max(x) < 128 and not g_unsafe_fold.intersection(x)]
+    return [_trigram_key(x) for x in grams]
+
+
+class TrigramIndex():
+    def __init__(self, path, folders):
+        self.path = path
+        self.folders = folders
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = g_index_header.unpack_from(self._mm)
+        if header[0] != g_index_magic:
+            self.close()
+            raise ValueError("Not a trigram index: {}".format(path))
+        self.nfiles, self.nkeys = header[1:3]
+        view = memoryview(self._mm)
+        for i, (name, code) in enumerate(g_index_sections):
+            offset, length = header[3 + 2 * i:5 + 2 * i]
+            setattr(self, name, view[offset:offset + length].cast(code))
+        self._ids = None
+        self._paths = None
+
+    def close(self):
+        for name, code in g_index_sections:
+            section = getattr(self, name, None)
+            if section is not None:
+                section.release()
+        self._mm.close()
+        self._file.close()
+
+    @property
+    def size(self):
+        return len(self._mm)
+
+    def file_path(self, i):
+        a, b = self.path_offsets[i], self.path_offsets[i + 1]
+        return bytes(self.paths[a:b]).decode("utf-8")
+
+    def file_id(self, path):
+        if self._ids is None:
+            self._ids = {x: i for i, x in enumerate(self.file_paths())}
+        return self._ids.get(path)
+
+    def file_paths(self):
+        if self._paths is None:
+            self._paths = [self.file_path(i) for i in range(self.nfiles)]
+        return self._paths
+
+    def file_trigrams(self, i):
+        return array.array("I", self.fwd[self.fwd_offsets[i]:
+                                         self.fwd_offsets[i + 1]])
+
+    def is_fresh(self, i, stat):
+        return (self.mtimes[i], self.sizes[i]) == (stat.st_mtime, stat.st_size)
+
+    # return None if text is too short to narrow down candidates
+    def candidates(self, text, case):
+        keys = _query_trigrams(text, case)
+        if not keys:
+            return None
+        result = None
+        for key in keys:
+            i = bisect.bisect_left(self.keys, key)
+            if i == self.nkeys or self.keys[i] != key:
+                return set()
+            ids = self.postings[self.post_offsets[i]:self.post_offsets[i + 1]]
+            result = (set(ids.tolist()) if result is None
+                      else result.intersection(ids.tolist()))
+            if not result:
+                return set()
+        return {self.file_path(i) for i in result}
+
+
+def _write_trigram_index(path, files, stats, trigrams):
+    postings = {}
+    for i, keys in enumerate(trigrams):
+        for key in keys:
+            postings.setdefault(key, array.array("I")).append(i)
+    keys = sorted(postings)
+    paths = [x.encode("utf-8") for x in files]
+    sections = {
+        "mtimes": array.array("d", (x[0] for x in stats)),
+        "sizes": array.array("Q", (x[1] for x in stats)),
+        "path_offsets": array.array("Q", itertools.accumulate(
+            [0] + [len(x) for x in paths])),
+        "paths": array.array("B", b"".join(paths)),
+        "fwd_offsets": array.array("Q", itertools.accumulate(
+            [0] + [len(x) for x in trigrams])),
+        "fwd": array.array("I", itertools.chain.from_iterable(trigrams)),
+        "keys": array.array("I", keys),
+        "post_offsets": array.array("Q", itertools.accumulate(
+            [0] + [len(postings[x]) for x in keys])),
+        "postings": array.array("I", itertools.chain.from_iterable(
+            postings[x] for x in keys))
+    }
+    offset = g_index_header.size
+    layout = []
+    for name, code in g_index_sections:
+        offset += -offset % 8
+        length = len(sections[name]) * sections[name].itemsize
+        layout.extend((offset, length))
+        offset += length
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(g_index_header.pack(g_index_magic, len(files), len(keys),
+                                    *layout))
+        for (name, code), section_offset in zip(g_index_sections,
+                                                layout[::2]):
+            f.write(b"\0" * (section_offset - f.tell()))
+            sections[name].tofile(f)
+    return tmp_path
+
+
+def _get_trigram_index_path(folders):
+    digest = hashlib.sha1("\n".join(folders).encode("utf-8")).hexdigest()
+    return os.path.join(sublime.cache_path(), "Exact Quick Find",
+                        "trigram-{}.idx".format(digest[:16]))
+
+
+def _open_trigram_index(path, folders):
+    try:
+        return TrigramIndex(path, folders)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _close_trigram_index():
+    global g_trigram_index
+    with g_trigram_lock:
+        if g_trigram_index is not None:
+            g_trigram_index.close()
+            g_trigram_index = None
+
+
+def _build_trigram_index(folders, paths, max_size):
+    global g_trigram_index
+    start = time.perf_counter()
+    path = _get_trigram_index_path(folders)
+    with g_trigram_lock:
+        old = g_trigram_index
+        if old is None or old.folders != folders:
+            old = _open_trigram_index(path, folders)
+    files, stats, trigrams = [], [], []
+    rescanned = 0
+    for x in paths:
+        try:
+            stat = os.stat(x)
+            i = None if old is None else old.file_id(x)
+            if i is not None and old.is_fresh(i, stat):
+                keys = old.file_trigrams(i)
+            else:
+                keys = _file_trigrams(x, max_size)
+                rescanned += 1
+        except OSError:
+            continue
+        files.append(x)
+        stats.append((stat.st_mtime, stat.st_size))
+        trigrams.append(keys)
+    if old is not None and not rescanned and old.nfiles == len(files):
+        index = old
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = _write_trigram_index(path, files, stats, trigrams)
+        with g_trigram_lock:
+            if old is not None:
+                old.close()
+            if g_trigram_index is not None and g_trigram_index is not old:
+                g_trigram_index.close()
+            g_trigram_index = None
+            os.replace(tmp_path, path)
+        index = _open_trigram_index(path, folders)
+    with g_trigram_lock:
+        if g_trigram_index is not None and g_trigram_index is not index:
+            g_trigram_index.close()
+        g_trigram_index = index
+        g_trigram_stats["build_time"] = time.perf_counter() - start
+        g_trigram_stats["rescanned"] = rescanned
+        g_trigram_stats["building"] = False
+
+
+def _update_trigram_index(window, settings):
+    # incremental update in the background, at most one at a time
+    with g_trigram_lock:
+        if g_trigram_stats.get("building"):
+            return
+        g_trigram_stats["building"] = True
+    folders = tuple(window.folders())
+    max_size = g_set.get("project_max_file_size", Def.PROJECT_MAX_FILE_SIZE)
+
+    def build():
+        try:
+            with g_trigram_lock:
+                dirty = set(g_trigram_dirty)
+            paths = _list_project_files(window, settings)
+            _build_trigram_index(folders, paths, max_size)
+            with g_trigram_lock:
+                g_trigram_dirty.difference_update(dirty)
+                g_trigram_stats["updated"] = time.time()
+        finally:
+            g_trigram_stats["building"] = False
+    threading.Thread(target=build, daemon=True).start()
+
+
+def _is_trigram_index_stale():
+    updated = g_trigram_stats.get("updated")
+    return (updated is None
+            or time.time() - updated > g_trigram_refresh_interval)
+
+
+def _is_in_folders(path, folders):
+    return any(path.startswith(os.path.join(x, "")) for x in folders)
+
+
+def _mark_trigram_dirty(view):
+    # the index can't tell a file was saved until its next update
+    path = view.file_name()
+    if path is None:
+        return
+    with g_trigram_lock:
+        g_trigram_dirty.add(path)
+
+
+def _describe_trigram_index():
+    index = g_trigram_index
+    stats = g_trigram_stats
+    if index is None:
+        lines = ["No trigram index loaded"]
+    else:
+        lines = ["Index: {}".format(index.path),
+                 "Folders: {}".format(", ".join(index.folders)),
+                 "Files: {}, trigrams: {}, size: {:.1f} KB".format(
+                     index.nfiles, index.nkeys, index.size / 1024)]
+    if "build_time" in stats:
+        lines.append("Last build: {:.3f} s, {} file{} rescanned".format(
+            stats["build_time"], stats["rescanned"],
+            "s" * (stats["rescanned"] != 1)))
+    if "updated" in stats:
+        lines.append("Last update: {:.0f} s ago, {} file{} saved since"
+                     .format(time.time() - stats["updated"],
+                             len(g_trigram_dirty),
+                             "s" * (len(g_trigram_dirty) != 1)))
+    if stats.get("building"):
+        lines.append("Building ...")
+    if "query_time" in stats:
+        size = stats["query_size"]
+        lines.append("Last query: {:.3f} ms, {} for \"{}\"".format(
+            stats["query_time"] * 1000,
+            "no narrowing" if size is None else "{} candidate file{}".format(
+                size, "s" * (size != 1)),
+            _abridge(stats["query_text"])))
+    return "\n".join(lines) + "\n"
+
+
 # --- finalize helpers --------------------------------------------------------
 
 def _show_this_region(eqf):
@@ -902,9 +2753,8 @@ def _set_indicator(eqf):
 
 
 def _get_selected_rank(eqf):
-    nlt = sum(eqf.selected[:eqf.this_index])
-    nge = sum(eqf.selected[eqf.this_index:])
-    return (nlt + 1, nlt + nge)
+    nlt = eqf.selected.rank(eqf.this_index)
+    return (nlt + 1, eqf.num_selected)
 
 
 def _set_ruler(eqf):
@@ -917,6 +2767,9 @@ def _set_ruler(eqf):
         j, m = _get_selected_rank(eqf)
         if m > 1:
             eqf.ruler += " (Selection {}/{})".format(j, m)
+    if g_set.get("show_line_number", Def.SHOW_LINE_NUMBER):
+        row = _row_of(_get_line_starts(eqf.view), eqf.this_reglet[0])
+        eqf.ruler += " Line {:,}".format(row + 1)
 
 
 # --- finalize ----------------------------------------------------------------
@@ -927,13 +2780,554 @@ def _finalize(eqf):
     _set_ruler(eqf)
 
 
-# --- listener ----------------------------------------------------------------
+# --- live count --------------------------------------------------------------
 
-def _trace_print_region(eqf, region, region_name):
-    if region is not None:
-        r1, c1, r2, c2 = _region_to_rowcol(eqf.view, region)
-        _trace_print("{} = {} ((row={}, col={}), (row={}, col={}))"
-                     .format(region_name, region, r1, c1, r2, c2), vid=eqf.vid)
+def _compile_pattern(text):
+    # python counterpart of the pattern built in _establish_matches(), not
+    # for [E] whose patterns are for the regex engine of sublime
+    return _get_regex(text, g_case, g_word, g_regex)
+
+
+def _iter_spans(view, text, snapshot):
+    # stream matches in order, with the engine of sublime for [E]
+    if not g_regex:
+        for m in _compile_pattern(text).finditer(snapshot):
+            yield m.span()
+        return
+    pattern, find_flags = _get_find_args(text)
+    region = view.find(pattern, 0, find_flags)
+    while region is not None and region.a != -1 and not region.empty():
+        yield region.a, region.b
+        region = view.find(pattern, region.b, find_flags)
+
+
+# return None if cancelled
+def _count_matches(view, text, snapshot, limit, cancelled, runs=None):
+    if g_case and not g_word and not g_regex and runs is None:
+        return snapshot.count(text)
+    stopped = []
+
+    def scan():
+        # checked on every match found, kept by the scope filter or not
+        for i, span in enumerate(_iter_spans(view, text, snapshot), 1):
+            if not i % 1024 and cancelled():
+                stopped.append(True)
+                return
+            yield span
+    spans = scan() if runs is None else _iter_in_scope(scan(), runs)
+    count = 0
+    for _ in spans:
+        count += 1
+        if count >= limit:
+            break
+    return None if stopped else count
+
+
+def _schedule_live_count(view):
+    # newer selection changes supersede (and cancel) pending counts
+    vid = view.id()
+    token = g_count_tokens.get(vid, 0) + 1
+    g_count_tokens[vid] = token
+    delay = g_set.get("live_match_count_delay", Def.LIVE_COUNT_DELAY)
+    sublime.set_timeout_async(lambda: _live_count(view, token), delay)
+
+
+def _live_count(view, token):
+    def cancelled():
+        return g_count_tokens.get(view.id()) != token
+    if cancelled() or not view.is_valid():
+        return
+    eqf = _peek_eqf(view)
+    if (eqf is not None and eqf.init) or len(view.sel()) == 0:
+        return
+    region = view.sel()[-1]
+    preview = ""
+    if not region.empty():
+        text = view.substr(region)
+        snapshot = view.substr(sublime.Region(0, view.size()))
+        limit = g_set.get("live_match_count_limit", Def.LIVE_COUNT_LIMIT)
+        selector = _get_scope_selector()
+        rejected = g_regex and _check_regex(view, text)
+        if rejected:
+            count = 0
+        else:
+            runs = _get_scope_runs(view, selector) if selector else None
+            count = _count_matches(view, text, snapshot, limit, cancelled,
+                                   runs)
+        if count is None:
+            _trace_print("Cancelled live count", vid=view.id())
+            return
+        if rejected:
+            preview = rejected
+        elif count == 0:
+            preview = "No Matches"
+        elif count >= limit and (not g_case or g_word or g_regex
+                                 or selector):
+            preview = "{}+ Matches".format(limit)
+        else:
+            preview = "{} Match{}".format(count, "es" if count > 1 else "")
+    if cancelled():
+        return
+    if eqf is None:
+        if g_previews.get(view.id(), "") == preview:
+            return
+        g_previews[view.id()] = preview
+    elif eqf.init or eqf.preview == preview:
+        return
+    else:
+        eqf.preview = preview
+    _show_status(view)
+
+
+# --- pipeline ----------------------------------------------------------------
+
+"""
+Finding the matches of a new ring is the slow part of a command in a large
+buffer. There, the command is split in two: matches are found on the async
+thread into the match store at a change count, then the command runs on
+the main thread and finds them ready. If the buffer has changed in
+between, the matches are found again. Commands given meanwhile are queued,
+and repeats of the same command are merged into a count. Any other command
+drops the queue, since the queued ones were given for the selections it
+changes. Only the search runs on the async thread; the ring index and
+selections are still worked out when the command runs.
+"""
+
+g_pipeline_min_size = 1 << 20
+g_pipeline_queue_size = 64
+
+
+def _ring_text(view, text):
+    # text a new ring would search for, typed or under the last selection
+    if text is not None:
+        return text
+    if len(view.sel()) == 0:
+        return None
+    region = view.sel()[-1]
+    if region.empty():
+        region = view.word(region)
+    text = view.substr(region)
+    return text if text.strip() else None
+
+
+def _has_matches(view, text):
+    key = _get_find_args(text) + (_get_scope_selector(),)
+    return key in _get_match_store(view)
+
+
+def _queue_command(queue, args):
+    if queue[-1][0] == args:
+        queue[-1][1] += 1
+    elif len(queue) < g_pipeline_queue_size:
+        queue.append([args, 1])
+    else:
+        _debug_print("Dropped command {}".format(args), level=Level.WARN)
+
+
+# return True if the command is left to run later
+def _defer_command(eqf, args):
+    view = eqf.view
+    queue = g_pending.get(eqf.vid)
+    if queue is not None:
+        _queue_command(queue, args)
+        return True
+    if ((eqf.init == Init.BASIC and "text" not in args)
+            or (view.size() < g_pipeline_min_size and not g_regex)
+            or not g_set.get("async_search", Def.ASYNC_SEARCH)):
+        return False
+    text = _ring_text(view, args.get("text"))
+    if text is None or _has_matches(view, text):
+        return False
+    g_pending[eqf.vid] = [[args, 1]]
+    change_count = view.change_count()
+    sublime.set_timeout_async(
+        lambda: _compute_matches(view, text, change_count), 0)
+    _trace_print("Deferred command {}".format(args), vid=eqf.vid)
+    return True
+
+
+def _compute_matches(view, text, change_count):
+    # async thread
+    if view.is_valid() and view.change_count() == change_count:
+        if not (g_regex and _check_regex(view, text)):
+            _find_all_shared(view, text)
+    sublime.set_timeout(lambda: _apply_commands(view, change_count), 0)
+
+
+def _apply_commands(view, change_count):
+    # main thread
+    queue = g_pending.pop(view.id(), None)
+    if queue is None or not view.is_valid():
+        return
+    # if the buffer has changed, the commands go through the pipeline again
+    ready = view.change_count() == change_count
+    for args, count in queue:
+        if ready:
+            args = dict(args, queued=True)
+        for _ in range(count):
+            view.run_command("exact_quick_find", args)
+
+
+# --- recorder ----------------------------------------------------------------
+
+"""
+A trace is a gzipped file of json lines. The first line holds the buffer
+text, selections, flags and settings when recording starts. Each following
+line holds a text command run in the view, as seen by on_post_text_command,
+with its args, the flags and selections after it, and, if the command has
+changed the buffer, the edit [begin, end, text] that turns the text before
+it into the text after it. Selections are flattened to [a1, b1, a2, ...].
+Only the buffer is copied on the main thread; the edit is worked out and
+lines are written in order on the async thread. Traces can be replayed
+outside Sublime Text with tools/replay.py.
+"""
+
+g_trace_version = 2
+
+g_recorded_settings = ("flip_case", "flip_whole_word", "flip_wrap_scan",
+                       "indicator", "selection_history_limit", "backend",
+                       "scope_filter_selector")
+
+
+def _flat_sel(view):
+    return list(itertools.chain.from_iterable((x.a, x.b) for x in view.sel()))
+
+
+def _get_trace_path(view):
+    name = "trace-{}-{}.jsonl.gz".format(time.strftime("%Y%m%d-%H%M%S"),
+                                         view.id())
+    return os.path.join(sublime.cache_path(), "Exact Quick Find", "traces",
+                        name)
+
+
+def _start_recording(view):
+    path = _get_trace_path(view)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    trace = gzip.open(path, "wt", encoding="utf-8")
+    header = {
+        "version": g_trace_version,
+        "text": view.substr(sublime.Region(0, view.size())),
+        "sel": _flat_sel(view),
+        "flags": [g_case, g_word, g_wrap, g_scope, g_regex],
+        "settings": {x: g_set.get(x) for x in g_recorded_settings
+                     if g_set.has(x)}
+    }
+    trace.write(json.dumps(header) + "\n")
+    g_recorders[view.id()] = {"trace": trace, "path": path, "steps": 0,
+                              "change_count": view.change_count(),
+                              "text": header["text"]}
+    return path
+
+
+def _stop_recording(vid):
+    recorder = g_recorders.pop(vid, None)
+    if recorder is None:
+        return None
+    # after the lines still to be written
+    sublime.set_timeout_async(recorder["trace"].close, 0)
+    return recorder
+
+
+def _common_prefix(a, b):
+    # the length of the longest common prefix of a and b, in O(n) copies
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a.startswith(b[lo:mid], lo):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a, b, limit):
+    lo, hi = 0, limit
+    na, nb = len(a), len(b)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a.endswith(b[nb - mid:nb - lo], 0, na - lo):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _diff_text(old, new):
+    # [begin, end, text] such that old[:begin] + text + old[end:] == new
+    begin = _common_prefix(old, new)
+    limit = min(len(old), len(new)) - begin
+    end = _common_suffix(old, new, limit)
+    return [begin, len(old) - end, new[begin:len(new) - end]]
+
+
+def _write_step(recorder, entry, text):
+    # async thread
+    if text is not None:
+        entry["edit"] = _diff_text(recorder["text"], text)
+        recorder["text"] = text
+    recorder["trace"].write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+
+def _record_command(view, cmd, args):
+    recorder = g_recorders[view.id()]
+    entry = {"cmd": cmd, "args": args,
+             "flags": [g_case, g_word, g_wrap, g_scope, g_regex],
+             "sel": _flat_sel(view)}
+    text = None
+    if view.change_count() != recorder["change_count"]:
+        recorder["change_count"] = view.change_count()
+        text = view.substr(sublime.Region(0, view.size()))
+    sublime.set_timeout_async(
+        lambda: _write_step(recorder, entry, text), 0)
+    recorder["steps"] += 1
+
+
+# --- resume ------------------------------------------------------------------
+
+"""
+On unload, each ring is saved to a setting of its view: offsets and
+selection bits as zlib-compressed base64 strings, with the indices, find
+flags, change count, buffer size, a crc of the text of the matches and
+the selections of the view. The first use of the view after the plugin is
+loaded again takes the setting back, and restores the ring only if the
+buffer, find flags and selections are still the same. The change count
+alone can't tell, since view settings are kept in sessions while the file
+may change on disk and the count starts over. Any other command run in the
+view before that drops the setting, as it would have reset the ring.
+"""
+
+g_ring_key = "exact_quick_find_ring"
+g_ring_version = 3
+
+
+def _pack(data):
+    return base64.b64encode(zlib.compress(data)).decode("ascii")
+
+
+def _unpack(text):
+    return zlib.decompress(base64.b64decode(text))
+
+
+def _pack_region(region):
+    return None if region is None else [region.a, region.b]
+
+
+def _unpack_region(pair):
+    return None if pair is None else sublime.Region(*pair)
+
+
+def _pack_sel(view):
+    return _pack(array.array("q", _flat_sel(view)).tobytes())
+
+
+def _ring_digest(view, reglets):
+    snapshot = view.substr(sublime.Region(0, view.size()))
+    crc = 0
+    for a, b in reglets:
+        crc = zlib.crc32(snapshot[a:b].encode("utf-8"), crc)
+    return crc
+
+
+def _save_ring(eqf):
+    begins = array.array("q", (x[0] for x in eqf.reglets))
+    ends = array.array("q", (x[1] for x in eqf.reglets))
+    ring = {
+        "version": g_ring_version,
+        "init": eqf.init,
+        "text": eqf.text,
+        "pattern": eqf.pattern,
+        "flags": [g_case, g_word, g_regex, _get_scope_selector()],
+        "change_count": eqf.view.change_count(),
+        "size": eqf.view.size(),
+        "digest": _ring_digest(eqf.view, eqf.reglets),
+        "sel": _pack_sel(eqf.view),
+        "code": eqf.code,
+        "last_code": eqf.last_code,
+        "reverse": eqf.reverse,
+        "begins": _pack(begins.tobytes()),
+        "ends": _pack(ends.tobytes()),
+        "selected": _pack(bytes(eqf.selected)),
+        "this_index": eqf.this_index,
+        "init_index": eqf.init_index,
+        "orig_region": _pack_region(eqf.orig_region),
+        "zero_region": _pack_region(eqf.zero_region)
+    }
+    eqf.view.settings().set(g_ring_key, ring)
+    _debug_print("Saved ring of {} regions".format(eqf.size), vid=eqf.vid)
+
+
+def _restore_ring(eqf):
+    settings = eqf.view.settings()
+    ring = settings.get(g_ring_key)
+    if ring is None:
+        return False
+    settings.erase(g_ring_key)
+    if (ring.get("version") != g_ring_version
+            or ring["change_count"] != eqf.view.change_count()
+            or ring["size"] != eqf.view.size()
+            or ring["sel"] != _pack_sel(eqf.view)
+            or ring["flags"] != [g_case, g_word, g_regex,
+                                 _get_scope_selector()]):
+        _debug_print("Discarded saved ring", vid=eqf.vid)
+        return False
+    begins = array.array("q")
+    begins.frombytes(_unpack(ring["begins"]))
+    ends = array.array("q")
+    ends.frombytes(_unpack(ring["ends"]))
+    reglets = RegletArray(begins, ends)
+    if ring["digest"] != _ring_digest(eqf.view, reglets):
+        _debug_print("Discarded saved ring of changed text", vid=eqf.vid)
+        return False
+    eqf.reglets = reglets
+    eqf.selected = list(map(bool, _unpack(ring["selected"])))
+    eqf.init = ring["init"]
+    eqf.text = ring["text"]
+    eqf.pattern = ring["pattern"]
+    eqf.change_count = ring["change_count"]
+    eqf.code = ring["code"]
+    eqf.last_code = ring["last_code"]
+    eqf.reverse = ring["reverse"]
+    eqf.this_index = ring["this_index"]
+    eqf.init_index = ring["init_index"]
+    eqf.orig_region = _unpack_region(ring["orig_region"])
+    eqf.zero_region = _unpack_region(ring["zero_region"])
+    if eqf.init == Init.BASIC:
+        # the matches are still good for other commands on the buffer
+        store = _get_match_store(eqf.view)
+        key = _get_find_args(eqf.text) + (_get_scope_selector(),)
+        store.setdefault(key, eqf.reglets)
+    _set_ruler(eqf)
+    _debug_print("Restored ring of {} regions".format(eqf.size), vid=eqf.vid)
+    return True
+
+
+# --- profiler ----------------------------------------------------------------
+
+"""
+While profiling, run() of every command of the plugin and the callbacks of
+the listener are swapped for wrappers that turn cProfile on around the
+outermost call. The originals are put back when profiling stops, so there
+is no cost at all otherwise. Profiling stops after a number of commands
+or a time limit, whichever comes first.
+"""
+
+g_profile_stats_lines = 40
+
+
+def _get_profiled_methods():
+    methods = []
+    for name, obj in list(globals().items()):
+        if not isinstance(obj, type):
+            continue
+        if (issubclass(obj, sublime_plugin.TextCommand)
+                and "ExactQuickFind" in name
+                and obj is not ExactQuickFindProfileCommandsCommand):
+            methods.append((obj, "run", True))
+        elif obj is ExactQuickFindListener:
+            methods.extend((obj, x, False) for x in dir(obj)
+                           if x.startswith("on_"))
+    return methods
+
+
+def _profiled(func, is_command):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = g_profile
+        # cProfile hooks a single thread, so async callbacks on the worker
+        # thread pass through, and depth is never changed by two threads
+        if (profile is None or profile["depth"]
+                or threading.get_ident() != profile["thread"]):
+            return func(*args, **kwargs)
+        profile["depth"] += 1
+        profile["profiler"].enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile["profiler"].disable()
+            profile["depth"] -= 1
+            if is_command:
+                profile["commands"] += 1
+                if (profile["commands"] >= profile["count"]
+                        or time.time() > profile["deadline"]):
+                    # after the listener has seen the command as well
+                    sublime.set_timeout(_stop_profile, 0)
+    return wrapper
+
+
+def _start_profile(view, count):
+    global g_profile
+    limit = g_set.get("profile_time_limit", Def.PROFILE_TIME_LIMIT)
+    g_profile = {
+        "profiler": cProfile.Profile(),
+        "view": view,
+        "count": count,
+        "commands": 0,
+        "depth": 0,
+        "thread": threading.get_ident(),
+        "start": time.time(),
+        "deadline": time.time() + limit,
+        "originals": []
+    }
+    for cls, name, is_command in _get_profiled_methods():
+        func = cls.__dict__.get(name)
+        if func is None:
+            continue
+        g_profile["originals"].append((cls, name, func))
+        setattr(cls, name, _profiled(func, is_command))
+    profile = g_profile
+    sublime.set_timeout(lambda: g_profile is profile and _stop_profile(),
+                        int(limit * 1000))
+
+
+def _stop_profile():
+    global g_profile
+    profile = g_profile
+    if profile is None:
+        return None
+    g_profile = None
+    for cls, name, func in profile["originals"]:
+        setattr(cls, name, func)
+    path = os.path.join(sublime.cache_path(), "Exact Quick Find", "profiles",
+                        "profile-{}.pstats".format(
+                            time.strftime("%Y%m%d-%H%M%S")))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    profile["profiler"].dump_stats(path)
+    _show_profile(profile, path)
+    return path
+
+
+def _show_profile(profile, path):
+    view = profile["view"]
+    if not view.is_valid() or view.window() is None:
+        return
+    out = io.StringIO()
+    try:
+        stats = pstats.Stats(profile["profiler"], stream=out)
+        stats.sort_stats("cumulative").print_stats(g_profile_stats_lines)
+    except TypeError:
+        # nothing was profiled
+        out.write("No calls profiled\n")
+    eqf = _peek_eqf(view)
+    size = 0 if eqf is None else eqf.size
+    header = ("{} command{} in {:.1f} s, {} characters, {} match{} in the "
+              "ring, {}\nSaved to {}\n").format(
+        profile["commands"], "s" * (profile["commands"] != 1),
+        time.time() - profile["start"], view.size(), size,
+        "es" * (size != 1), _get_flags(), path)
+    window = view.window()
+    panel = window.create_output_panel("exact_quick_find_profile")
+    _append_to_view(panel, header + out.getvalue())
+    window.run_command("show_panel",
+                       {"panel": "output.exact_quick_find_profile"})
+
+
+# --- listener ----------------------------------------------------------------
+
+def _trace_print_region(eqf, region, region_name):
+    if region is not None:
+        r1, c1, r2, c2 = _region_to_rowcol(eqf.view, region)
+        _trace_print("{} = {} ((row={}, col={}), (row={}, col={}))"
+                     .format(region_name, region, r1, c1, r2, c2), vid=eqf.vid)
     else:
         _trace_print("{} = None".format(region_name), vid=eqf.vid)
 
@@ -943,10 +3337,12 @@ def _describe():
     nv = sum(len([s for s in w.sheets() if s.view()])
              for w in sublime.windows())
     ne = len(g_eqf_center)
-    return "{} window{}, {} view{}, {} eqf object{}".format(
+    nm = len(g_match_center)
+    return "{} window{}, {} view{}, {} eqf object{}, {} match store{}".format(
             nw, "s" * (nw > 1),
             nv, "s" * (nv > 1),
-            ne, "s" * (ne > 1))
+            ne, "s" * (ne > 1),
+            nm, "s" * (nm > 1))
 
 
 def _trace_print_listener(eqf, cmd):
@@ -983,31 +3379,66 @@ def _trace_print_listener(eqf, cmd):
 
 class ExactQuickFindListener(sublime_plugin.EventListener):
     def on_activated(self, view):
-        eqf = _get_eqf(view)
-        _set_status(eqf)
-        _trace_print_listener(eqf, "on_activated_async")
+        # only the view activated needs its status, the flags being the
+        # same in every other
+        _show_status(view)
+        eqf = _peek_eqf(view)
+        if eqf is not None:
+            eqf.alert = ""
+            eqf.notice = ""
+            _trace_print_listener(eqf, "on_activated_async")
 
     def on_modified(self, view):
-        eqf = _get_eqf(view)
+        _del_match_store(view.buffer_id())
+        eqf = _peek_eqf(view)
+        if eqf is None:
+            return
         _reset_status(eqf)
         eqf.view.erase_regions("exact_quick_find_indicator")
 
+    def on_selection_modified_async(self, view):
+        if not g_set.get("live_match_count", Def.LIVE_COUNT):
+            return
+        eqf = _peek_eqf(view)
+        if eqf is None or not eqf.init:
+            _schedule_live_count(view)
+
     def on_pre_save(self, view):
         if g_set.get("save_flags_on_save", Def.SAVE_FLAGS):
             _save_settings()
 
+    def on_post_save(self, view):
+        if g_set.get("project_trigram_index", Def.TRIGRAM_INDEX):
+            _mark_trigram_dirty(view)
+
     def on_post_text_command(self, view, cmd, args):
-        eqf = _get_eqf(view)
         if cmd.startswith("exact_quick_find"):
+            eqf = _get_eqf(view)
             _trace_print_listener(eqf, cmd)
             _set_status(eqf)
         else:
-            _reset_eqf(eqf)
-            _reset_status(eqf)
-            view.erase_regions("exact_quick_find_indicator")
-        eqf.last_text_cmd = cmd
+            g_pending.pop(view.id(), None)
+            eqf = _peek_eqf(view)
+            if eqf is not None:
+                _reset_eqf(eqf)
+                _reset_status(eqf)
+                view.erase_regions("exact_quick_find_indicator")
+            else:
+                # a ring saved on unload is as stale as a reset one
+                view.settings().erase(g_ring_key)
+                if g_previews.pop(view.id(), None):
+                    _show_status(view)
+        if eqf is not None:
+            eqf.last_text_cmd = cmd
+        if view.id() in g_recorders:
+            _record_command(view, cmd, args)
 
     def on_close(self, view):
+        _stop_recording(view.id())
+        g_pending.pop(view.id(), None)
+        g_previews.pop(view.id(), None)
+        g_count_tokens.pop(view.id(), None)
+        g_view_scans.pop(view.id(), None)
         _del_eqf(view)
 
 
@@ -1028,6 +3459,16 @@ def _toggle_wrap_scan():
     g_wrap = not g_wrap
 
 
+def _toggle_scope_filter():
+    global g_scope
+    g_scope = not g_scope
+
+
+def _toggle_regex():
+    global g_regex
+    g_regex = not g_regex
+
+
 class ExactQuickFindToggleCaseSensitiveCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         _toggle_case()
@@ -1051,6 +3492,27 @@ class ExactQuickFindToggleWrapScanCommand(sublime_plugin.TextCommand):
         eqf.notice = "Wrap Scan" if g_wrap else "No Wrap Scan"
 
 
+class ExactQuickFindToggleScopeFilterCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        eqf = _get_eqf(self.view)
+        if not g_set.get("scope_filter_selector", Def.SCOPE_SELECTOR):
+            msg = "No Scope Filter Selector"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        _toggle_scope_filter()
+        _reset_eqf(eqf)
+        eqf.notice = "Scope Filter" if g_scope else "No Scope Filter"
+
+
+class ExactQuickFindToggleRegexCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        _toggle_regex()
+        eqf = _get_eqf(self.view)
+        _reset_eqf(eqf)
+        eqf.notice = "Regex" if g_regex else "No Regex"
+
+
 class ExactQuickFindFlipFindFlagsCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         do_reset = False
@@ -1069,17 +3531,28 @@ class ExactQuickFindFlipFindFlagsCommand(sublime_plugin.TextCommand):
 
 
 class ExactQuickFindCommand(sublime_plugin.TextCommand):
-    def run(self, edit, code, reverse=False):
+    def run(self, edit, code, reverse=False, text=None, queued=False):
         eqf = _get_eqf(self.view)
+        if not queued:
+            args = {"code": code, "reverse": reverse}
+            if text is not None:
+                args["text"] = text
+            if _defer_command(eqf, args):
+                return
+        if text is not None:
+            # typed text always starts a new ring
+            _reset_eqf(eqf)
         if eqf.code not in {Code.GO_FIRST, Code.GO_BACK}:
             eqf.last_code = eqf.code
         eqf.code = code
         eqf.reverse = reverse
         if eqf.init != Init.BASIC:
-            if not _basic_init(eqf):
+            if not _basic_init(eqf, text):
                 return
         else:
+            snapshot = _snapshot_history(eqf)
             _dispatch(eqf)
+            _record_history(eqf, snapshot)
         _finalize(eqf)
 
 
@@ -1092,7 +3565,13 @@ class ExtendedExactQuickFindCommand(sublime_plugin.TextCommand):
         if eqf.init == Init.NOT_INIT:
             if not _extended_init(eqf):
                 return
-        _dispatch(eqf)
+        if code in g_peek_codes:
+            # peeks never change selections, so skip the history snapshot
+            _dispatch(eqf)
+        else:
+            snapshot = _snapshot_history(eqf)
+            _dispatch(eqf)
+            _record_history(eqf, snapshot)
         _finalize(eqf)
 
 
@@ -1112,6 +3591,23 @@ class ExactQuickFindGotoPrevCommand(sublime_plugin.TextCommand):
         eqf.notice = "Move"
 
 
+g_typed_text = ""
+
+
+class ExactQuickFindGotoNextTypedCommand(sublime_plugin.TextCommand):
+    def run(self, edit, reverse=False):
+        def on_done(text):
+            global g_typed_text
+            if not text:
+                return
+            g_typed_text = text
+            args = {"code": Code.GOTO_NEXT, "reverse": reverse, "text": text}
+            self.view.run_command("exact_quick_find", args)
+        caption = "Find {}:".format("Pattern" if g_regex else "Text")
+        self.view.window().show_input_panel(caption, g_typed_text, on_done,
+                                            None, None)
+
+
 class ExactQuickFindAddNextCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         eqf = _get_eqf(self.view)
@@ -1136,6 +3632,366 @@ class ExactQuickFindAddAllCommand(sublime_plugin.TextCommand):
         eqf.notice = "Add All"
 
 
+class ExactQuickFindBulkSelectCommand(sublime_plugin.TextCommand):
+    def run(self, edit, subtract=False, where="range", start=None, stop=None,
+            step=1, prompt=False):
+        if prompt:
+            self._prompt(subtract)
+            return
+        eqf = _get_eqf(self.view)
+        eqf.last_code = eqf.code
+        eqf.reverse = False
+        if eqf.init == Init.NOT_INIT:
+            # enter the ring with the current match added
+            eqf.code = Code.ADD_THIS
+            if not _basic_init(eqf):
+                return
+        eqf.code = Code.SUBTRACT_THIS if subtract else Code.ADD_THIS
+        eqf.notice = "Subtract" if subtract else "Add"
+        slices = _bulk_slices(eqf, where, start, stop, step)
+        snapshot = _snapshot_history(eqf)
+        if not any(range(*s.indices(eqf.size)) for s in slices):
+            msg = "No Matches In Range"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+        elif not _bulk_select(eqf, slices, not subtract):
+            msg = "Already Subtracted" if subtract else "Already Added"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+        else:
+            _sync_selected_regions(eqf)
+            _record_history(eqf, snapshot)
+        _finalize(eqf)
+
+    def _prompt(self, subtract):
+        def on_done(text):
+            args = _parse_range(text)
+            if args is None:
+                sublime.status_message("Invalid Range \"{}\"".format(text))
+                return
+            args["subtract"] = subtract
+            self.view.run_command("exact_quick_find_bulk_select", args)
+        caption = "{} Range (e.g. 1000-2000 or 1-/2):".format(
+            "Subtract" if subtract else "Add")
+        self.view.window().show_input_panel(caption, "", on_done, None, None)
+
+
+class ExactQuickFindGotoNextPerCursorCommand(sublime_plugin.TextCommand):
+    def run(self, edit, reverse=False):
+        eqf = _get_eqf(self.view)
+        _reset_eqf(eqf)
+        if len(self.view.sel()) == 0:
+            msg = "No Selections"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        moved = _goto_per_cursor(self.view, reverse)
+        if not moved:
+            msg = "No Other Matches"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        eqf.notice = "Move {} Cursor{}".format(moved, "s" * (moved > 1))
+
+
+class ExactQuickFindReplaceSelectedMatchesCommand(
+        sublime_plugin.TextCommand):
+    def run(self, edit, replacement=None):
+        eqf = _get_eqf(self.view)
+        msg = ""
+        if not eqf.init or not eqf.num_selected:
+            msg = "No Selected Matches"
+        elif (eqf.init == Init.BASIC
+                and eqf.change_count != self.view.change_count()):
+            msg = "Buffer Changed"
+        if msg:
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        if replacement is None:
+            self._prompt(eqf)
+            return
+        num = eqf.num_selected
+        begin, end, text, regions = _build_replacement(eqf, replacement)
+        # one edit, so one undo step, however many matches
+        self.view.replace(edit, sublime.Region(begin, end), text)
+        self.view.sel().clear()
+        self.view.sel().add_all(regions)
+        _reset_eqf(eqf)
+        eqf.notice = "Replace {} Match{}".format(num, "es" * (num > 1))
+
+    def _prompt(self, eqf):
+        def on_done(text):
+            self.view.run_command("exact_quick_find_replace_selected_matches",
+                                  {"replacement": text})
+        num = eqf.num_selected
+        caption = "Replace {} Match{} With:".format(num, "es" * (num > 1))
+        self.view.window().show_input_panel(caption, "", on_done, None, None)
+
+
+class ExactQuickFindGotoNextLineWithMatchCommand(
+        sublime_plugin.TextCommand):
+    def run(self, edit, reverse=False):
+        eqf = _get_eqf(self.view)
+        if eqf.init != Init.BASIC:
+            # enter the ring at the current match
+            self.view.run_command("exact_quick_find",
+                                  {"code": Code.ADD_THIS})
+            if eqf.init != Init.BASIC:
+                return
+        eqf.notice = "Move"
+        index = _next_line_index(eqf, _get_line_starts(self.view), reverse)
+        if index is None:
+            msg = "No Other Lines With Matches"
+            if not g_wrap:
+                msg = "No Lines With Matches {}".format(
+                    "Above" if reverse else "Below")
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        eqf.last_code = eqf.code
+        eqf.code = Code.GOTO_NEXT
+        eqf.reverse = reverse
+        snapshot = _snapshot_history(eqf)
+        _subtract_this_region(eqf)
+        eqf.this_index = index
+        _add_this_region(eqf)
+        _record_history(eqf, snapshot)
+        _finalize(eqf)
+
+
+class ExactQuickFindUndoSelectionCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        eqf = _get_eqf(self.view)
+        if _step_history(eqf, undo=True):
+            _finalize(eqf)
+        eqf.notice = "Undo"
+
+
+class ExactQuickFindRedoSelectionCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        eqf = _get_eqf(self.view)
+        if _step_history(eqf, undo=False):
+            _finalize(eqf)
+        eqf.notice = "Redo"
+
+
+class ExactQuickFindExportMatchesCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        eqf = _get_eqf(self.view)
+        eqf.notice = "Export"
+        text, reglets = _get_view_matches(eqf)
+        if not reglets:
+            msg = "No Matches To Export"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        name = self.view.file_name() or self.view.name() or "untitled"
+        header = "{} match{} for {} {} in {}\n\n".format(
+            len(reglets), "es" * (len(reglets) > 1), _describe_matches(text),
+            _get_flags(), name)
+        out = self.view.window().new_file()
+        out.set_name("Exact Quick Find: {}".format(_describe_matches(text)))
+        out.set_scratch(True)
+        _append_to_view(out, header)
+        snapshot = self.view.substr(sublime.Region(0, self.view.size()))
+        sublime.set_timeout_async(
+            lambda: _export_matches(out, reglets, snapshot), 0)
+
+
+class ExactQuickFindShowDensityCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        eqf = _get_eqf(self.view)
+        eqf.notice = "Density"
+        text, reglets = _get_view_matches(eqf)
+        if not reglets:
+            msg = "No Matches Found"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        density = _get_density(eqf, reglets)
+        marker = None
+        if eqf.init:
+            marker = self.view.rowcol(eqf.this_region.begin())[0] + 1
+        header = "{} match{} for {} {} by line\n\n".format(
+            len(reglets), "es" * (len(reglets) > 1), _describe_matches(text),
+            _get_flags())
+        window = self.view.window()
+        panel = window.create_output_panel("exact_quick_find_density")
+        text = header + _format_density(density, marker=marker)
+        _append_to_view(panel, text)
+        window.run_command("show_panel",
+                           {"panel": "output.exact_quick_find_density"})
+
+
+class ExactQuickFindListMatchesCommand(sublime_plugin.TextCommand):
+    def run(self, edit, index=None, start=None):
+        eqf = _get_eqf(self.view)
+        if eqf.init == Init.NOT_INIT:
+            eqf.last_code = eqf.code
+            eqf.reverse = False
+            if len(self.view.sel()) == 1:
+                # enter the ring with the current match added
+                eqf.code = Code.ADD_THIS
+                if not _basic_init(eqf):
+                    return
+            elif not _extended_init(eqf):
+                return
+        elif (eqf.init == Init.BASIC
+                and eqf.change_count != self.view.change_count()):
+            msg = "Buffer Changed"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        if index is not None:
+            _go_to_listed(eqf, index)
+            eqf.notice = "Go"
+            return
+        self._show(eqf, _list_page_start(eqf) if start is None else start)
+
+    def _show(self, eqf, start):
+        view = self.view
+        items, targets = _list_page(eqf, start)
+
+        def on_select(i):
+            if i == -1:
+                view.show(eqf.this_region)
+                return
+            kind, value = targets[i]
+            args = {"index": value} if kind == "match" else {"start": value}
+            # a page is shown again once this panel has closed
+            sublime.set_timeout(lambda: view.run_command(
+                "exact_quick_find_list_matches", args), 0)
+
+        def on_highlight(i):
+            kind, value = targets[i]
+            if kind == "match":
+                view.show_at_center(_reglet_to_region(eqf.reglets[value]))
+
+        selected = targets.index(("match", eqf.this_index)) if (
+            start <= eqf.this_index < start + g_list_page_size) else 0
+        view.window().show_quick_panel(items, on_select, 0, selected,
+                                       on_highlight)
+
+
+class ExactQuickFindGotoNextInWindowCommand(sublime_plugin.TextCommand):
+    def run(self, edit, reverse=False):
+        eqf = _get_eqf(self.view)
+        _reset_eqf(eqf)
+        eqf.notice = "Move"
+        msg = _goto_in_window(eqf, reverse)
+        if msg:
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+
+
+class ExactQuickFindGotoNextInProjectCommand(sublime_plugin.TextCommand):
+    def run(self, edit, reverse=False):
+        eqf = _get_eqf(self.view)
+        _reset_eqf(eqf)
+        eqf.notice = "Move"
+        msg = _goto_in_project(eqf, reverse)
+        if msg:
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+
+
+class ExactQuickFindTrigramIndexStatusCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        window = self.view.window()
+        if not g_set.get("project_trigram_index", Def.TRIGRAM_INDEX):
+            text = ("Trigram index is off. "
+                    "Set \"project_trigram_index\" to true.\n")
+        else:
+            if g_trigram_index is None:
+                _update_trigram_index(window, self.view.settings())
+            text = _describe_trigram_index()
+        panel = window.create_output_panel("exact_quick_find_index")
+        _append_to_view(panel, text)
+        window.run_command("show_panel",
+                           {"panel": "output.exact_quick_find_index"})
+
+
+class ExactQuickFindVerifyBackendsCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        eqf = _get_eqf(self.view)
+        text = eqf.text if eqf.init == Init.BASIC else None
+        if text is None and len(self.view.sel()):
+            region = self.view.sel()[-1]
+            if region.empty():
+                region = self.view.word(region)
+            text = self.view.substr(region)
+        if not text:
+            msg = "No Selections"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        lines = ["Backends for \"{}\" {} on {} characters\n".format(
+            _abridge(text), _get_flags(), self.view.size())]
+        lines.extend(_verify_backends(self.view, text))
+        window = self.view.window()
+        panel = window.create_output_panel("exact_quick_find_backends")
+        _append_to_view(panel, "\n".join(lines) + "\n")
+        window.run_command("show_panel",
+                           {"panel": "output.exact_quick_find_backends"})
+
+
+class ExactQuickFindProfileCommandsCommand(sublime_plugin.TextCommand):
+    def run(self, edit, count=None):
+        eqf = _get_eqf(self.view)
+        if g_profile is not None:
+            _stop_profile()
+            eqf.notice = "Stop Profiling"
+            return
+        if count is None:
+            self._prompt()
+            return
+        _start_profile(self.view, max(count, 1))
+        eqf.notice = "Profiling {} Command{}".format(count, "s" * (count > 1))
+
+    def _prompt(self):
+        def on_done(text):
+            try:
+                count = int(text)
+            except ValueError:
+                sublime.status_message("Invalid Number \"{}\"".format(text))
+                return
+            self.view.run_command("exact_quick_find_profile_commands",
+                                  {"count": count})
+        self.view.window().show_input_panel("Profile Next N Commands:", "10",
+                                            on_done, None, None)
+
+
+class ExactQuickFindStartRecordingCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        eqf = _get_eqf(self.view)
+        if self.view.id() in g_recorders:
+            msg = "Already Recording"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        path = _start_recording(self.view)
+        eqf.notice = "Recording"
+        sublime.status_message("Exact Quick Find: Recording to {}"
+                               .format(path))
+
+
+class ExactQuickFindStopRecordingCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        eqf = _get_eqf(self.view)
+        recorder = _stop_recording(self.view.id())
+        if recorder is None:
+            msg = "Not Recording"
+            eqf.alert = msg
+            _debug_print(msg, vid=eqf.vid)
+            return
+        eqf.notice = "Stop Recording"
+        sublime.status_message(
+            "Exact Quick Find: Recorded {} command{} to {}".format(
+                recorder["steps"], "s" * (recorder["steps"] != 1),
+                recorder["path"]))
+
+
 def _get_cmd(eqf):
     if ((eqf.init == Init.NOT_INIT and len(eqf.view.sel()) == 1)
             or eqf.init == Init.BASIC):
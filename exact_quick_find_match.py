@@ -0,0 +1,205 @@
+"""
+MIT License
+
+Copyright (c) 2021 Aaron Fu Lei
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+Matching semantics of Exact Quick Find without Sublime Text.
+
+    python -m exact_quick_find_match [options] TEXT [FILE ...]
+
+Offsets are counted in characters with line endings normalized to "\\n",
+as in a Sublime Text buffer, so they agree with what the editor selects.
+"""
+
+# standard
+import argparse
+import bisect
+import io
+import os
+import re
+import sys
+import time
+
+
+# --- matching ----------------------------------------------------------------
+
+def word_pattern(text, regex=False):
+    # the pattern passed to view.find_all() with [W]
+    if regex:
+        return "\\b(?:{})\\b".format(text)
+    return "\\b{}\\b".format(re.escape(text))
+
+
+def compile_pattern(text, case, word, regex=False):
+    """
+    Compile text as view.find_all() would search for it. With regex, text
+    is a pattern, and ^ and $ match at every line as they do in a buffer.
+    """
+    if word:
+        pattern = word_pattern(text, regex)
+    else:
+        pattern = text if regex else re.escape(text)
+    flags = re.MULTILINE if regex else 0
+    return re.compile(pattern, flags if case else flags | re.IGNORECASE)
+
+
+def _line_starts(text):
+    starts = [0]
+    pos = text.find("\n")
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = text.find("\n", pos + 1)
+    return starts
+
+
+def iter_matches(lines, text, case, word, regex=False):
+    """
+    Yield (begin, end, row, col, line) for each match, rows and cols being
+    1-based. Lines are read one at a time unless text spans several lines.
+    """
+    pattern = compile_pattern(text, case, word, regex)
+    if regex or "\n" in text:
+        # a match may span lines, so fall back to matching the whole input
+        content = "".join(lines)
+        starts = _line_starts(content)
+        for m in pattern.finditer(content):
+            row = bisect.bisect_right(starts, m.start()) - 1
+            col = m.start() - starts[row]
+            end = content.find("\n", m.start())
+            line = content[starts[row]:len(content) if end == -1 else end]
+            yield m.start(), m.end(), row + 1, col + 1, line
+        return
+    # \b sees "\n" before a line as it sees the start of input
+    base = 0
+    for row, line in enumerate(lines):
+        for m in pattern.finditer(line):
+            yield (base + m.start(), base + m.end(), row + 1, m.start() + 1,
+                   line.rstrip("\n"))
+        base += len(line)
+
+
+def ring_order(matches, start, reverse, wrap):
+    # order matches as goto next / prev would visit them from start
+    index = bisect.bisect_left([x[0] for x in matches], start)
+    before, after = matches[:index], matches[index:]
+    if reverse:
+        before, after = after[::-1], before[::-1]
+    return after + before if wrap else after
+
+
+# --- cli ---------------------------------------------------------------------
+
+def _open_lines(path):
+    # universal newlines normalize line endings as sublime does
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8",
+                                errors="replace", newline=None)
+    return open(path, encoding="utf-8", errors="replace", newline=None)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m exact_quick_find_match",
+        description="Find matches as Exact Quick Find does in Sublime Text.")
+    parser.add_argument("text", help="text to find")
+    parser.add_argument("files", nargs="*", default=["-"],
+                        help="files to search, or - for stdin (default)")
+    parser.add_argument("-i", "--ignore-case", action="store_true",
+                        help="turn off case sensitive, i.e. [c]")
+    parser.add_argument("-s", "--substring", action="store_true",
+                        help="turn off whole word, i.e. [w]")
+    parser.add_argument("-E", "--regex", action="store_true",
+                        help="treat text as a regular expression, i.e. [E]")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("-c", "--count", action="store_true",
+                        help="print the number of matches")
+    output.add_argument("-o", "--offsets", action="store_true",
+                        help="print begin and end offsets of matches")
+    parser.add_argument("--start", type=int, default=None,
+                        help="list matches in ring order from this offset")
+    parser.add_argument("--reverse", action="store_true",
+                        help="list matches in ring order backwards")
+    parser.add_argument("--no-wrap", action="store_true",
+                        help="turn off wrap scan for ring order, i.e. [r]")
+    parser.add_argument("--time", action="store_true",
+                        help="print elapsed time and throughput to stderr")
+    return parser.parse_args(argv)
+
+
+def _format(match, args, prefix):
+    begin, end, row, col, line = match
+    if args.offsets:
+        return "{}{} {}".format(prefix, begin, end)
+    return "{}{}:{}: {}".format(prefix, row, col, line)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    if not args.text:
+        print("Nothing to find", file=sys.stderr)
+        return 2
+    if args.regex:
+        try:
+            compile_pattern(args.text, True, False, True)
+        except re.error as e:
+            print("Invalid pattern: {}".format(e), file=sys.stderr)
+            return 2
+    case = not args.ignore_case
+    word = not args.substring
+    ring = args.start is not None or args.reverse
+    found = False
+    for path in args.files:
+        prefix = "{}:".format(path) if len(args.files) > 1 else ""
+        start = time.perf_counter()
+        try:
+            with _open_lines(path) as lines:
+                matches = iter_matches(lines, args.text, case, word,
+                                       args.regex)
+                if ring:
+                    origin = args.start
+                    if origin is None:
+                        origin = sys.maxsize if args.reverse else 0
+                    matches = ring_order(list(matches), origin, args.reverse,
+                                         not args.no_wrap)
+                count = 0
+                for match in matches:
+                    count += 1
+                    if not args.count:
+                        print(_format(match, args, prefix))
+                size = path != "-" and os.path.getsize(path)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 2
+        if args.count:
+            print("{}{}".format(prefix, count))
+        if args.time:
+            elapsed = time.perf_counter() - start
+            rate = size / elapsed / 1e6 if size and elapsed else 0
+            print("{}{} matches in {:.3f} s, {:.1f} MB/s".format(
+                prefix, count, elapsed, rate), file=sys.stderr)
+        found = found or count > 0
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
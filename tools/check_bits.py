@@ -0,0 +1,141 @@
+"""
+Check SelectionBits of Exact Quick Find against a plain list of bools,
+outside Sublime Text.
+
+    python tools/check_bits.py [options]
+
+Each trial makes bits of a random size and fill, then writes random single
+bits, slices, slices set to one value and flipped runs to both, as the ring,
+bulk select and undo do. After every write, count, rank, select and
+find_next are compared with what the list gives. Exit status is 1 on the
+first difference, which is printed.
+"""
+
+# standard
+import argparse
+import os
+import random
+import sys
+
+
+g_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(g_root, "tools", "fake"), g_root]
+
+# plugin
+from exact_quick_find import SelectionBits  # noqa: E402
+
+
+def _random_slice(rng, size):
+    start = rng.randrange(-size - 1, size + 2)
+    stop = rng.randrange(-size - 1, size + 2)
+    step = rng.choice((None, None, 1, 2, 3, -1, -2))
+    return slice(start, stop, step)
+
+
+def _random_runs(rng, size):
+    cuts = sorted(rng.sample(range(size + 1), min(size + 1, 2 * rng.randint(
+        1, 4))))
+    return list(zip(cuts[::2], cuts[1::2]))
+
+
+def _write(rng, bits, plain):
+    size = len(plain)
+    roll = rng.random()
+    if roll < 0.3 and size:
+        index = rng.randrange(-size, size)
+        value = rng.random() < 0.5
+        bits[index] = value
+        plain[index] = value
+        return "bits[{}] = {}".format(index, value)
+    if roll < 0.55:
+        s = _random_slice(rng, size)
+        values = [rng.random() < 0.5 for _ in range(*s.indices(size))]
+        bits[s] = values
+        plain[s] = values
+        return "bits[{}] = {}".format(s, values)
+    if roll < 0.8:
+        slices = [_random_slice(rng, size) for _ in range(rng.randint(1, 3))]
+        value = rng.random() < 0.5
+        bits.set_slices(slices, value)
+        for s in slices:
+            plain[s] = [value] * len(range(*s.indices(size)))
+        return "set_slices({}, {})".format(slices, value)
+    runs = _random_runs(rng, size)
+    bits.flip_runs(runs)
+    for a, b in runs:
+        plain[a:b] = [not x for x in plain[a:b]]
+    return "flip_runs({})".format(runs)
+
+
+def _compare(bits, plain):
+    # return a description of the first difference, or None
+    if list(bits) != plain:
+        return "bits {} != {}".format(list(bits), plain)
+    for value in (True, False):
+        if bits.count(value) != plain.count(value):
+            return "count({})".format(value)
+        where = [i for i, x in enumerate(plain) if x == value]
+        for index in range(len(plain) + 1):
+            if bits.rank(index, value) != sum(x < index for x in where):
+                return "rank({}, {})".format(index, value)
+        for k, index in enumerate(where, 1):
+            if bits.select(k, value) != index:
+                return "select({}, {})".format(k, value)
+        for index in range(len(plain)):
+            for reverse in (False, True):
+                if reverse:
+                    before = [x for x in where if x < index]
+                    expected = (before or where or [None])[-1]
+                else:
+                    after = [x for x in where if x > index]
+                    expected = (after or where or [None])[0]
+                if bits.find_next(index, value, reverse) != expected:
+                    return "find_next({}, {}, {})".format(
+                        index, value, reverse)
+    return None
+
+
+def check(trials, writes, max_size, seed):
+    """
+    Return None, or a description of the first difference found.
+    """
+    rng = random.Random(seed)
+    for trial in range(trials):
+        size = rng.randint(0, max_size)
+        fill = rng.random() < 0.5
+        bits = SelectionBits(size, fill)
+        plain = [fill] * size
+        steps = ["SelectionBits({}, {})".format(size, fill)]
+        for _ in range(writes):
+            steps.append(_write(rng, bits, plain))
+            diff = _compare(bits, plain)
+            if diff:
+                return "trial {}: {} after\n  {}".format(
+                    trial, diff, "\n  ".join(steps))
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python tools/check_bits.py",
+        description="Check SelectionBits against a plain list of bools.")
+    parser.add_argument("--trials", type=int, default=500,
+                        help="number of bits made (default 500)")
+    parser.add_argument("--writes", type=int, default=20,
+                        help="writes to each (default 20)")
+    parser.add_argument("--size", type=int, default=70,
+                        help="largest number of bits (default 70)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the random writes (default 0)")
+    args = parser.parse_args(argv)
+    diff = check(args.trials, args.writes, args.size, args.seed)
+    if diff:
+        print("FAILED: {}".format(diff))
+        return 1
+    print("{} trials of {} writes, no difference".format(
+        args.trials, args.writes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
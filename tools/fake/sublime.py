@@ -0,0 +1,511 @@
+"""
+An in-memory stand-in for the sublime module, good enough to load Exact Quick
+Find and run its commands outside Sublime Text. It is used by the scripts in
+tools/ and is not shipped with the package.
+
+Only what the plugin calls is implemented. Timeouts, on either thread, are
+queued until run_timeouts() is called. Views keep their text in a plain
+string and find_all() is backed by the re module.
+"""
+
+# standard
+import os
+import re
+import tempfile
+
+
+IGNORECASE = 2
+LITERAL = 1
+HIDDEN = 128
+TRANSIENT = 4
+ENCODED_POSITION = 1
+DRAW_NO_FILL = 32
+DRAW_NO_OUTLINE = 256
+DRAW_EMPTY_AS_OVERWRITE = 4096
+KEEP_OPEN_ON_FOCUS_LOST = 2
+MONOSPACE_FONT = 1
+
+g_settings = {}
+g_windows = []
+g_next_id = [0]
+g_timeouts = []
+g_cache = os.path.join(tempfile.gettempdir(), "exact_quick_find_fake")
+
+
+def version():
+    return "4126"
+
+
+def platform():
+    return "linux"
+
+
+def load_settings(name):
+    return g_settings.setdefault(name, Settings())
+
+
+def save_settings(name):
+    pass
+
+
+def windows():
+    return list(g_windows)
+
+
+def active_window():
+    return g_windows[0] if g_windows else Window()
+
+
+def set_timeout(callback, delay=0):
+    g_timeouts.append(callback)
+
+
+def set_timeout_async(callback, delay=0):
+    g_timeouts.append(callback)
+
+
+def run_timeouts():
+    # including those queued by the callbacks themselves
+    while g_timeouts:
+        g_timeouts.pop(0)()
+
+
+def discard_timeouts():
+    del g_timeouts[:]
+
+
+def cache_path():
+    return g_cache
+
+
+def packages_path():
+    return os.path.join(g_cache, "Packages")
+
+
+def status_message(msg):
+    pass
+
+
+def error_message(msg):
+    print("error:", msg)
+
+
+def _next_id():
+    g_next_id[0] += 1
+    return g_next_id[0]
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def erase(self, key):
+        self.pop(key, None)
+
+    def has(self, key):
+        return key in self
+
+    def add_on_change(self, tag, callback):
+        pass
+
+    def clear_on_change(self, tag):
+        pass
+
+
+class Region:
+    __slots__ = ("a", "b", "xpos")
+
+    def __init__(self, a, b=None, xpos=-1):
+        self.a = a
+        self.b = a if b is None else b
+        self.xpos = xpos
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def empty(self):
+        return self.a == self.b
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def intersects(self, other):
+        return self.begin() < other.end() and other.begin() < self.end()
+
+    def cover(self, other):
+        return Region(min(self.begin(), other.begin()),
+                      max(self.end(), other.end()))
+
+    def __eq__(self, other):
+        return (isinstance(other, Region) and
+                (self.a, self.b) == (other.a, other.b))
+
+    def __lt__(self, other):
+        return (self.begin(), self.end()) < (other.begin(), other.end())
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __len__(self):
+        return self.size()
+
+    def __repr__(self):
+        return "({}, {})".format(self.a, self.b)
+
+
+class Selection:
+    # regions are kept sorted, overlapping ones merged as sublime does
+    def __init__(self):
+        self._regions = []
+
+    def __len__(self):
+        return len(self._regions)
+
+    def __getitem__(self, index):
+        return self._regions[index]
+
+    def __iter__(self):
+        return iter(list(self._regions))
+
+    def _merge(self):
+        merged = []
+        for x in sorted(self._regions):
+            if merged and (x.begin() < merged[-1].end() or x == merged[-1]):
+                last = merged.pop()
+                x = Region(last.begin(), max(last.end(), x.end()))
+            merged.append(x)
+        self._regions = merged
+
+    def clear(self):
+        self._regions = []
+
+    def add(self, region):
+        self._regions.append(region)
+        self._merge()
+
+    def add_all(self, regions):
+        self._regions.extend(regions)
+        self._merge()
+
+    def subtract(self, region):
+        kept = []
+        for x in self._regions:
+            if x.intersects(region) or x == region:
+                if x.begin() < region.begin():
+                    kept.append(Region(x.begin(), region.begin()))
+                if region.end() < x.end():
+                    kept.append(Region(region.end(), x.end()))
+            else:
+                kept.append(x)
+        self._regions = kept
+
+    def contains(self, region):
+        return any(x.contains(region) for x in self._regions)
+
+
+class View:
+    def __init__(self, text="", window=None):
+        self._id = _next_id()
+        self._buffer_id = self._id
+        self._text = text
+        self._change_count = 0
+        self._sel = Selection()
+        self._regions = {}
+        self._status = {}
+        self._settings = Settings()
+        self._window = window
+        self._file_name = None
+        self._name = ""
+        self._depth = 0
+        self._closed = False
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._buffer_id
+
+    def change_count(self):
+        return self._change_count
+
+    def is_valid(self):
+        return not self._closed
+
+    def is_loading(self):
+        return False
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return self._file_name
+
+    def name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+
+    def set_scratch(self, scratch):
+        pass
+
+    def set_read_only(self, read_only):
+        pass
+
+    def assign_syntax(self, syntax):
+        pass
+
+    def settings(self):
+        return self._settings
+
+    def sel(self):
+        return self._sel
+
+    def size(self):
+        return len(self._text)
+
+    def substr(self, x):
+        if isinstance(x, int):
+            return self._text[x:x + 1]
+        return self._text[x.begin():x.end()]
+
+    def find_all(self, pattern, flags=0):
+        regex = _compile(pattern, flags)
+        return [Region(m.start(), m.end()) for m in regex.finditer(self._text)]
+
+    def find(self, pattern, start, flags=0):
+        m = _compile(pattern, flags).search(self._text, start)
+        return Region(m.start(), m.end()) if m else Region(-1, -1)
+
+    def find_by_selector(self, selector):
+        # no syntax highlighting here, a test may fill in scope regions
+        return self.get_regions("scope:" + selector)
+
+    def rowcol(self, point):
+        head = self._text[:point]
+        return head.count("\n"), point - (head.rfind("\n") + 1)
+
+    def text_point(self, row, col):
+        lines = self._text.split("\n")
+        return sum(len(x) + 1 for x in lines[:row]) + col
+
+    def line(self, x):
+        begin = x if isinstance(x, int) else x.begin()
+        end = x if isinstance(x, int) else x.end()
+        a = self._text.rfind("\n", 0, begin) + 1
+        b = self._text.find("\n", end)
+        return Region(a, len(self._text) if b == -1 else b)
+
+    def full_line(self, x):
+        line = self.line(x)
+        return Region(line.a, min(line.b + 1, self.size()))
+
+    def lines(self, region):
+        lines = [self.line(region.begin())]
+        while lines[-1].end() < region.end():
+            lines.append(self.line(lines[-1].end() + 1))
+        return lines
+
+    def word(self, x):
+        point = x if isinstance(x, int) else x.begin()
+        a = b = point
+        while a > 0 and _is_word(self._text[a - 1]):
+            a -= 1
+        while b < len(self._text) and _is_word(self._text[b]):
+            b += 1
+        return Region(a, b)
+
+    def visible_region(self):
+        return Region(0, self.size())
+
+    def show(self, x, *args, **kwargs):
+        pass
+
+    def show_at_center(self, x, *args, **kwargs):
+        pass
+
+    def add_regions(self, key, regions, *args, **kwargs):
+        self._regions[key] = list(regions)
+
+    def get_regions(self, key):
+        return list(self._regions.get(key, []))
+
+    def erase_regions(self, key):
+        self._regions.pop(key, None)
+
+    def set_status(self, key, value):
+        self._status[key] = value
+
+    def get_status(self, key):
+        return self._status.get(key, "")
+
+    def erase_status(self, key):
+        self._status.pop(key, None)
+
+    def add_phantom(self, *args, **kwargs):
+        return 0
+
+    def erase_phantoms(self, key):
+        pass
+
+    def set_text(self, text):
+        # what an edit outside the plugin would leave behind
+        self._text = text
+        self._change_count += 1
+
+    def replace(self, edit, region, text):
+        self.set_text(self._text[:region.begin()] + text +
+                      self._text[region.end():])
+
+    def insert(self, edit, point, text):
+        self.replace(edit, Region(point), text)
+        return len(text)
+
+    def erase(self, edit, region):
+        self.replace(edit, region, "")
+
+    def close(self):
+        import sublime_plugin
+        if self._closed:
+            return False
+        self._closed = True
+        window = self._window
+        if window is not None and self in window._views:
+            window._views.remove(self)
+            if window._active is self:
+                window._active = window._views[-1] if window._views else None
+        sublime_plugin.fire("on_close", self)
+        return True
+
+    def run_command(self, cmd, args=None):
+        # listeners only hear about commands not run by another command
+        import sublime_plugin
+        args = args or {}
+        top = self._depth == 0
+        self._depth += 1
+        try:
+            if top:
+                sublime_plugin.fire("on_text_command", self, cmd, args)
+            _run_builtin(self, cmd, args) or sublime_plugin.run(
+                self, cmd, args)
+        finally:
+            self._depth -= 1
+        if top:
+            sublime_plugin.fire("on_post_text_command", self, cmd, args)
+
+
+class Window:
+    def __init__(self):
+        self._id = _next_id()
+        self._views = []
+        self._panels = {}
+        self._active = None
+        self._folders = []
+        self.quick_panel = None
+        self.input_panel = None
+        g_windows.append(self)
+
+    def id(self):
+        return self._id
+
+    def views(self):
+        return list(self._views)
+
+    def sheets(self):
+        return [Sheet(x) for x in self._views]
+
+    def active_view(self):
+        return self._active
+
+    def new_file(self, *args, **kwargs):
+        return self.add_view("")
+
+    def add_view(self, text):
+        view = View(text, self)
+        self._views.append(view)
+        self._active = view
+        return view
+
+    def focus_view(self, view):
+        self._active = view
+
+    def folders(self):
+        return list(self._folders)
+
+    def find_open_file(self, path):
+        for view in self._views:
+            if view.file_name() == path:
+                return view
+        return None
+
+    def open_file(self, name, flags=0):
+        path = name.rsplit(":", 2)[0] if flags & ENCODED_POSITION else name
+        with open(path, encoding="utf-8", errors="replace") as f:
+            view = self.add_view(f.read())
+        view._file_name = path
+        return view
+
+    def create_output_panel(self, name, *args):
+        view = View("", self)
+        self._panels[name] = view
+        return view
+
+    def find_output_panel(self, name):
+        return self._panels.get(name)
+
+    def run_command(self, cmd, args=None):
+        pass
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1,
+                         on_highlight=None):
+        self.quick_panel = (items, on_select, selected_index, on_highlight)
+
+    def show_input_panel(self, caption, initial_text, on_done, on_change,
+                         on_cancel):
+        self.input_panel = (caption, initial_text, on_done)
+
+
+class Sheet:
+    def __init__(self, view):
+        self._view = view
+
+    def view(self):
+        return self._view
+
+
+def _compile(pattern, flags):
+    if flags & LITERAL:
+        pattern = re.escape(pattern)
+    try:
+        return re.compile(pattern,
+                          re.IGNORECASE if flags & IGNORECASE else 0)
+    except re.error as e:
+        raise ValueError(str(e))
+
+
+def _is_word(char):
+    return char.isalnum() or char == "_"
+
+
+def _run_builtin(view, cmd, args):
+    # the few built-in commands the plugin runs itself
+    if cmd == "expand_selection":
+        last = view.sel()[-1]
+        view.sel().subtract(last)
+        view.sel().add(view.word(last.begin()))
+    elif cmd == "append":
+        view.insert(None, view.size(), args["characters"])
+    else:
+        return False
+    return True
@@ -0,0 +1,69 @@
+"""
+An in-memory stand-in for the sublime_plugin module, see sublime.py.
+
+Commands and listeners register themselves when their classes are defined.
+Commands are looked up by the name sublime derives from the class name, e.g.
+ExactQuickFindCommand is run as "exact_quick_find".
+"""
+
+# standard
+import re
+
+
+g_commands = {}
+g_listeners = []
+
+
+def command_name(cls):
+    name = cls.__name__
+    if name.endswith("Command"):
+        name = name[:-len("Command")]
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+
+def run(view, cmd, args):
+    # as in sublime, unknown commands do nothing
+    if cmd in g_commands:
+        g_commands[cmd](view).run(None, **args)
+
+
+def fire(event, *args):
+    for listener in g_listeners:
+        callback = getattr(listener, event, None)
+        if callback:
+            callback(*args)
+
+
+def reset():
+    # forget what a previously loaded plugin registered
+    g_commands.clear()
+    del g_listeners[:]
+
+
+class _Registry(type):
+    def __init__(cls, *args):
+        super().__init__(*args)
+        if cls.__module__ == __name__:
+            return
+        if issubclass(cls, EventListener):
+            g_listeners.append(cls())
+        else:
+            g_commands[command_name(cls)] = cls
+
+
+class TextCommand(metaclass=_Registry):
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand(metaclass=_Registry):
+    def __init__(self, window):
+        self.window = window
+
+
+class EventListener(metaclass=_Registry):
+    pass
+
+
+class ViewEventListener(metaclass=_Registry):
+    pass
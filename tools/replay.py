@@ -0,0 +1,175 @@
+"""
+Replay a trace recorded by Exact Quick Find: Start Recording outside Sublime
+Text and report how long each command takes.
+
+    python tools/replay.py [options] TRACE
+
+The plugin is loaded against the in-memory fake in tools/fake. Commands of
+the plugin are run again, timed, and the selections they leave are checked
+against those recorded. Any other command is not run; its recorded edit of
+the buffer and selections are put in place as if it had been. Exit status
+is 1 if any selection differs from the trace.
+
+Work the plugin leaves to a timeout is not run, since any command it runs
+later was recorded as a step of its own.
+"""
+
+# standard
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+
+g_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(g_root, "tools", "fake"), g_root]
+
+# fake
+import sublime  # noqa: E402
+import sublime_plugin  # noqa: E402
+
+# plugin
+import exact_quick_find as eqf_module  # noqa: E402
+
+
+g_skipped = {"exact_quick_find_start_recording",
+             "exact_quick_find_stop_recording"}
+
+
+def _is_eqf_cmd(cmd):
+    return cmd.startswith(("exact_quick_find", "extended_exact_quick_find"))
+
+
+def _read_trace(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        steps = [json.loads(x) for x in f if x.strip()]
+    if header.get("version") not in (1, 2):
+        raise ValueError("Unknown trace version {}".format(
+            header.get("version")))
+    return header, steps
+
+
+def _set_sel(view, flat):
+    view.sel().clear()
+    view.sel().add_all(sublime.Region(a, b)
+                       for a, b in zip(flat[::2], flat[1::2]))
+
+
+def _get_sel(view):
+    return [p for x in view.sel() for p in (x.a, x.b)]
+
+
+def _apply_edit(view, step):
+    # version 2 traces hold the edit, version 1 traces the whole text
+    if "edit" in step:
+        begin, end, text = step["edit"]
+        old = view.substr(sublime.Region(0, view.size()))
+        view.set_text(old[:begin] + text + old[end:])
+    else:
+        view.set_text(step["text"])
+    sublime_plugin.fire("on_modified", view)
+
+
+def _set_flags(flags):
+    eqf_module.g_case, eqf_module.g_word, eqf_module.g_wrap = flags[:3]
+    if len(flags) > 3:
+        eqf_module.g_scope = flags[3]
+    if len(flags) > 4:
+        eqf_module.g_regex = flags[4]
+
+
+def _load(header):
+    settings = sublime.load_settings(eqf_module.g_set_filename)
+    settings.update(header.get("settings", {}))
+    window = sublime.Window()
+    view = window.add_view(header["text"])
+    _set_sel(view, header["sel"])
+    eqf_module.plugin_loaded()
+    _set_flags(header["flags"])
+    return view
+
+
+def replay(header, steps, quiet=False):
+    """
+    Return a list of (step, cmd, milliseconds, ok) for each command of the
+    plugin that was run.
+    """
+    view = _load(header)
+    flags = header["flags"]
+    sel = header["sel"]
+    results = []
+    for i, step in enumerate(steps, 1):
+        cmd = step["cmd"]
+        if ("edit" in step or "text" in step) and not _is_eqf_cmd(cmd):
+            _apply_edit(view, step)
+        if not _is_eqf_cmd(cmd) or cmd in g_skipped:
+            _set_sel(view, step["sel"])
+            sublime_plugin.fire("on_post_text_command", view, cmd,
+                                step["args"])
+        else:
+            _set_flags(flags)
+            if _get_sel(view) != sel:
+                # the selections were moved by something other than a command
+                _set_sel(view, sel)
+            start = time.perf_counter()
+            view.run_command(cmd, step["args"])
+            elapsed = (time.perf_counter() - start) * 1000
+            ok = _get_sel(view) == step["sel"]
+            results.append((i, cmd, elapsed, ok))
+            if not quiet or not ok:
+                print("{:5} {:8.3f} ms {} {} {}".format(
+                    i, elapsed, "ok" if ok else "MISMATCH", cmd,
+                    json.dumps(step["args"], sort_keys=True)))
+            if not ok:
+                _set_sel(view, step["sel"])
+        sublime.discard_timeouts()
+        eqf_module.g_pending.clear()
+        flags = step["flags"]
+        sel = step["sel"]
+    eqf_module.plugin_unloaded()
+    return results
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def _print_summary(results):
+    times = sorted(x[2] for x in results)
+    mismatches = sum(not x[3] for x in results)
+    print("{} commands, {} mismatch{}, p50 {:.3f} ms, p95 {:.3f} ms, "
+          "max {:.3f} ms, total {:.3f} ms".format(
+              len(results), mismatches, "es" * (mismatches != 1),
+              _percentile(times, 0.5), _percentile(times, 0.95),
+              times[-1] if times else 0, sum(times)))
+    slowest = sorted(results, key=lambda x: -x[2])[:5]
+    for i, cmd, elapsed, ok in slowest:
+        print("  slowest: step {} {} {:.3f} ms".format(i, cmd, elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python tools/replay.py",
+        description="Replay an Exact Quick Find trace and time each step.")
+    parser.add_argument("trace", help="a trace-*.jsonl.gz file")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only print mismatches and the summary")
+    args = parser.parse_args(argv)
+    try:
+        header, steps = _read_trace(args.trace)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    results = replay(header, steps, args.quiet)
+    _print_summary(results)
+    return 1 if any(not x[3] for x in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Run Exact Quick Find through a long scripted session outside Sublime Text and
+check that memory and listener cost stay flat.
+
+    python tools/soak.py [options]
+
+The plugin is loaded against the in-memory fake in tools/fake. Each cycle
+opens a view with big rings, runs a random mix of commands of the plugin
+in it, in rings of words and of selections, exports matches and shows
+their density, makes random edits and moves, and closes the oldest view
+once more than --open views are open. Every so often, a sample is taken of
+len(g_eqf_center), the number of reglets kept by eqf objects and match
+stores, and the latency of the listener callbacks since the last sample.
+Then every view is closed and the memory traced by tracemalloc is taken,
+so that what is measured is what the plugin keeps beyond its views rather
+than the size of the rings open at the time.
+
+A line is fitted through the samples after the first quarter, which is
+left for caches to fill. Exit status is 1 if memory or the p95 listener
+latency grows faster than the slopes given, or if eqf objects or match
+stores outlive their views.
+"""
+
+# standard
+import argparse
+import functools
+import gc
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+
+g_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(g_root, "tools", "fake"), g_root]
+
+# fake
+import sublime  # noqa: E402
+import sublime_plugin  # noqa: E402
+
+# plugin
+import exact_quick_find as eqf_module  # noqa: E402
+
+
+g_words = ("alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta",
+           "theta")
+g_codes = [x for x in range(1, len(eqf_module.Code._names))]
+g_latencies = []
+
+
+def _timed(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            g_latencies.append((time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+def _time_listener():
+    cls = eqf_module.ExactQuickFindListener
+    for name in [x for x in vars(cls) if x.startswith("on_")]:
+        setattr(cls, name, _timed(getattr(cls, name)))
+
+
+def _make_text(rng, num_words):
+    # one line in eight words, so each ring has about num_words / 8 matches
+    words = rng.choices(g_words, k=num_words)
+    return "".join(x + ("\n" if i % 8 == 7 else " ")
+                   for i, x in enumerate(words))
+
+
+def _select_word(rng, view):
+    text = view.substr(sublime.Region(0, view.size()))
+    word = rng.choice(g_words)
+    begin = text.find(word, rng.randrange(max(view.size(), 1)))
+    if begin == -1:
+        begin = text.find(word)
+    view.sel().clear()
+    if begin == -1:
+        view.sel().add(sublime.Region(0))
+    else:
+        view.sel().add(sublime.Region(begin, begin + len(word)))
+    # as any command that moves the cursors would
+    view.run_command("move", {"by": "words"})
+    sublime_plugin.fire("on_selection_modified_async", view)
+
+
+def _select_words(rng, view):
+    # two selections, so that peeking starts an extended ring
+    _select_word(rng, view)
+    first = view.sel()[0]
+    _select_word(rng, view)
+    view.sel().add(first)
+    view.run_command("exact_quick_find_peek_next")
+    _export(view)
+    view.run_command("exact_quick_find_show_density")
+
+
+def _export(view):
+    window = view.window()
+    before = set(x.id() for x in window.views())
+    view.run_command("exact_quick_find_export_matches")
+    sublime.run_timeouts()
+    for other in window.views():
+        if other.id() not in before:
+            other.close()
+    window.focus_view(view)
+
+
+def _edit(rng, view):
+    point = rng.randrange(view.size() + 1)
+    if rng.random() < 0.5 or view.size() < 16:
+        point += view.insert(None, point, rng.choice(g_words) + " ")
+    else:
+        point = min(point, view.size() - 8)
+        view.erase(None, sublime.Region(point, point + 8))
+    # the fake leaves selections where they were, so put the cursor where
+    # typing would have left it
+    view.sel().clear()
+    view.sel().add(sublime.Region(point))
+    sublime_plugin.fire("on_modified", view)
+    view.run_command("insert", {"characters": ""})
+
+
+def _run_commands(rng, view, num_commands):
+    for _ in range(num_commands):
+        roll = rng.random()
+        if roll < 0.1:
+            _edit(rng, view)
+        elif roll < 0.2:
+            _select_word(rng, view)
+        elif roll < 0.25:
+            _select_words(rng, view)
+        elif roll < 0.27:
+            _export(view)
+        elif roll < 0.29:
+            view.run_command("exact_quick_find_show_density")
+        else:
+            view.run_command("exact_quick_find",
+                             {"code": rng.choice(g_codes),
+                              "reverse": rng.random() < 0.3})
+        sublime.run_timeouts()
+
+
+def _count_reglets():
+    count = sum(len(x.reglets or ()) for x in eqf_module.g_eqf_center.values())
+    for _, store in eqf_module.g_match_center.values():
+        count += sum(len(x) for x in store.values())
+    return count
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def _slope(xs, ys):
+    # least squares
+    n = len(xs)
+    if n < 2:
+        return 0
+    mx = sum(xs) / n
+    my = sum(ys) / n
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if not sxx:
+        return 0
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+
+
+def _take_snapshot():
+    # leave out what the soak itself keeps
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, tracemalloc.__file__)))
+
+
+def _sample(cycle, open_views):
+    latencies = sorted(g_latencies)
+    del g_latencies[:]
+    sample = {
+        "cycle": cycle,
+        "eqf": len(eqf_module.g_eqf_center),
+        "views": len(open_views),
+        "stores": len(eqf_module.g_match_center),
+        "reglets": _count_reglets(),
+        "p95": _percentile(latencies, 0.95),
+        "max": latencies[-1] if latencies else 0
+    }
+    while open_views:
+        open_views.pop(0).close()
+    sublime.run_timeouts()
+    del g_latencies[:]
+    # the cache of the re module is bounded, and also filled by the fake
+    re.purge()
+    gc.collect()
+    snapshot = _take_snapshot()
+    sample["snapshot"] = snapshot
+    sample["memory"] = sum(x.size for x in snapshot.traces) / 1024
+    sample["left"] = (len(eqf_module.g_eqf_center) +
+                      len(eqf_module.g_match_center))
+    return sample
+
+
+def _print_sample(sample):
+    print("{cycle:7} {eqf:5} eqf {views:5} views {stores:5} stores "
+          "{reglets:9} reglets p95 {p95:8.3f} ms max {max:8.3f} ms, "
+          "then {memory:8.0f} KB {left} left".format(**sample))
+
+
+def _print_growth(first, last, limit=10):
+    stats = last.compare_to(first, "lineno")
+    print("largest growth since the end of warm up:")
+    for stat in stats[:limit]:
+        print("  {}".format(stat))
+
+
+def soak(args):
+    """
+    Return the samples taken.
+    """
+    rng = random.Random(args.seed)
+    settings = sublime.load_settings(eqf_module.g_set_filename)
+    settings.set("async_search", False)
+    windows = [sublime.Window() for _ in range(args.windows)]
+    eqf_module.plugin_loaded()
+    _time_listener()
+    tracemalloc.start()
+    every = max(args.cycles // args.samples, 1)
+    warm = args.cycles // 4
+    open_views = []
+    samples = []
+    for cycle in range(1, args.cycles + 1):
+        window = windows[cycle % len(windows)]
+        view = window.add_view(_make_text(rng, args.words))
+        sublime_plugin.fire("on_activated", view)
+        open_views.append(view)
+        _select_word(rng, view)
+        _run_commands(rng, view, args.commands)
+        if len(open_views) > args.open:
+            open_views.pop(0).close()
+        sublime.run_timeouts()
+        if cycle % every == 0:
+            samples.append(_sample(cycle, open_views))
+            _print_sample(samples[-1])
+    steady = [x for x in samples if x["cycle"] > warm]
+    if args.growth and steady:
+        _print_growth(steady[0]["snapshot"], steady[-1]["snapshot"])
+    for sample in samples:
+        del sample["snapshot"]
+    tracemalloc.stop()
+    eqf_module.plugin_unloaded()
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python tools/soak.py",
+        description="Soak Exact Quick Find in a long scripted session and "
+                    "check memory and listener latency stay flat.")
+    parser.add_argument("--cycles", type=int, default=2000,
+                        help="views opened and closed (default 2000)")
+    parser.add_argument("--commands", type=int, default=10,
+                        help="commands, edits and moves per view "
+                             "(default 10)")
+    parser.add_argument("--words", type=int, default=8000,
+                        help="words in each view, an eighth of which are "
+                             "in each ring (default 8000)")
+    parser.add_argument("--open", type=int, default=20,
+                        help="views kept open at a time (default 20)")
+    parser.add_argument("--windows", type=int, default=2,
+                        help="number of windows (default 2)")
+    parser.add_argument("--samples", type=int, default=20,
+                        help="number of samples (default 20)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the random session (default 0)")
+    parser.add_argument("--max-memory-slope", type=float, default=64,
+                        help="KB of growth allowed per 1000 cycles "
+                             "(default 64)")
+    parser.add_argument("--max-latency-slope", type=float, default=0.5,
+                        help="ms of p95 listener latency growth allowed per "
+                             "1000 cycles (default 0.5)")
+    parser.add_argument("--growth", action="store_true",
+                        help="print the lines whose allocations grew most")
+    args = parser.parse_args(argv)
+    if args.cycles < 1 or args.samples < 1 or args.open < 1:
+        print("Need at least one cycle, sample and open view",
+              file=sys.stderr)
+        return 2
+    samples = soak(args)
+    steady = [x for x in samples if x["cycle"] > args.cycles // 4]
+    xs = [x["cycle"] / 1000 for x in steady]
+    memory = _slope(xs, [x["memory"] for x in steady])
+    latency = _slope(xs, [x["p95"] for x in steady])
+    failed = []
+    if memory > args.max_memory_slope:
+        failed.append("memory")
+    if latency > args.max_latency_slope:
+        failed.append("latency")
+    left = max(x["left"] for x in samples)
+    if left or any(x["eqf"] > x["views"] for x in samples):
+        failed.append("state of closed views")
+    print("memory {:+.1f} KB, p95 latency {:+.3f} ms per 1000 cycles, "
+          "at most {} eqf object{} or match store{} of closed views".format(
+              memory, latency, left, "s" * (left != 1), "s" * (left != 1)))
+    if failed:
+        print("FAILED: {}".format(", ".join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Measure what Exact Quick Find costs at startup and on tab switches in a large
+session, outside Sublime Text.
+
+    python tools/startup_bench.py [options]
+
+A synthetic session of views spread over several windows is opened in the
+in-memory fake in tools/fake. The plugin is then imported and loaded, each
+view is activated once, as when a restored session is first looked through,
+and then again for a number of rounds, as on later tab switches. None of
+this runs a command of the plugin, so no eqf object should be created.
+"""
+
+# standard
+import argparse
+import os
+import sys
+import time
+
+
+g_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(g_root, "tools", "fake"), g_root]
+
+# fake
+import sublime  # noqa: E402
+import sublime_plugin  # noqa: E402
+
+
+def _make_session(num_views, num_windows, num_lines):
+    line = "def foo_{0}(bar, baz):  # return bar + baz * {0}\n"
+    views = []
+    windows = [sublime.Window() for _ in range(num_windows)]
+    for i in range(num_views):
+        text = "".join(line.format(i + j) for j in range(num_lines))
+        views.append(windows[i % num_windows].add_view(text))
+    return views
+
+
+def _activate(view):
+    start = time.perf_counter()
+    view.window().focus_view(view)
+    sublime_plugin.fire("on_activated", view)
+    return (time.perf_counter() - start) * 1000
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def _print_times(name, times):
+    times = sorted(times)
+    print("{:<16} p50 {:.3f} ms, p95 {:.3f} ms, max {:.3f} ms, "
+          "total {:.3f} ms".format(
+              name, _percentile(times, 0.5), _percentile(times, 0.95),
+              times[-1] if times else 0, sum(times)))
+
+
+def bench(num_views, num_windows, num_lines, rounds):
+    """
+    Return (load milliseconds, first activation times, switch times, number
+    of eqf objects left, number of views without a status).
+    """
+    views = _make_session(num_views, num_windows, num_lines)
+    start = time.perf_counter()
+    import exact_quick_find as eqf_module
+    eqf_module.plugin_loaded()
+    load = (time.perf_counter() - start) * 1000
+    first = [_activate(x) for x in views]
+    switches = [_activate(x) for _ in range(rounds) for x in views]
+    sublime.discard_timeouts()
+    created = len(eqf_module.g_eqf_center)
+    missing = sum(not x.get_status("exact_quick_find_status") for x in views)
+    eqf_module.plugin_unloaded()
+    return load, first, switches, created, missing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python tools/startup_bench.py",
+        description="Time loading Exact Quick Find and activating views in "
+                    "a large synthetic session.")
+    parser.add_argument("--views", type=int, default=300,
+                        help="number of views in the session (default 300)")
+    parser.add_argument("--windows", type=int, default=3,
+                        help="number of windows (default 3)")
+    parser.add_argument("--lines", type=int, default=200,
+                        help="number of lines in each view (default 200)")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="rounds of tab switches through every view "
+                             "after the first (default 3)")
+    args = parser.parse_args(argv)
+    if args.views < 1 or args.windows < 1:
+        print("Need at least one view and one window", file=sys.stderr)
+        return 2
+    load, first, switches, created, missing = bench(
+        args.views, args.windows, args.lines, args.rounds)
+    print("{} views in {} windows, {} lines each".format(
+        args.views, args.windows, args.lines))
+    print("{:<16} {:.3f} ms".format("load", load))
+    _print_times("first activation", first)
+    _print_times("tab switch", switches)
+    print("{} eqf object{} created, {} view{} without a status".format(
+        created, "s" * (created != 1), missing, "s" * (missing != 1)))
+    return 1 if created or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())